@@ -0,0 +1,184 @@
+import hashlib
+import os
+import sqlite3
+from collections import Counter
+
+'''
+    Persistent on-disk index of the unfiltered word counts of text files.
+
+    Every file is stored with its size, mtime and the number of bytes counted
+    so far (up to the end of its last complete line) together with a hash of
+    those bytes. A file whose size and mtime did not change is answered from
+    the index alone, a file that only grew is counted from the stored offset
+    on, any other change recounts the file.
+'''
+
+# Size of the blocks read when hashing a file or looking for its last line end
+READ_SIZE = 1024 * 1024
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS files (
+        id INTEGER PRIMARY KEY,
+        path TEXT UNIQUE NOT NULL,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        offset INTEGER NOT NULL,
+        hash TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS counts (
+        file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+        word TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (file_id, word)
+    ) WITHOUT ROWID;
+'''
+
+
+def last_line_end(path, size):
+    """Position just after the last newline in the first size bytes of a file, 0 if there is none."""
+    with open(path, 'rb') as file:
+        end = size
+        while end > 0:
+            start = max(0, end - READ_SIZE)
+            file.seek(start)
+            position = file.read(end - start).rfind(b'\n')
+            if position >= 0:
+                return start + position + 1
+            end = start
+    return 0
+
+
+def hash_prefix(path, end, checkpoint=None):
+    """
+    BLAKE2b hex digest of the first end bytes of a file.
+
+    With a checkpoint <= end the digest of the first checkpoint bytes is
+    computed in the same read and (checkpoint digest, end digest) is returned.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    checkpoint_digest = None
+    position = 0
+    with open(path, 'rb') as file:
+        while position < end:
+            if checkpoint is not None and position == checkpoint:
+                checkpoint_digest = digest.hexdigest()
+            stop = end if checkpoint is None or position >= checkpoint else checkpoint
+            block = file.read(min(READ_SIZE, stop - position))
+            if not block:
+                raise ValueError(f'{path} is shorter than {end} bytes')
+            digest.update(block)
+            position += len(block)
+    if checkpoint is None:
+        return digest.hexdigest()
+    if checkpoint_digest is None:
+        checkpoint_digest = digest.hexdigest()
+    return checkpoint_digest, digest.hexdigest()
+
+
+class count_index:
+    """
+    SQLite index of word counts, one entry per file.
+
+    The words are counted by a function count_range(path, start, end) -> Counter
+    passed to the methods, the index only decides which bytes still have to be
+    counted. The stored counts are unfiltered, --minimal and --excludedList are
+    applied when the index is queried.
+
+    Attributes:
+        filename (str): Path of the SQLite database.
+        connection (sqlite3.Connection): Open connection to the database.
+
+    Methods:
+        update(path, count_range): Brings the entry of one file up to date, returns it.
+        counts(paths, count_range, minimal, excluded): Filtered word counts of the files.
+        close(): Closes the database.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def _entry(self, path):
+        return self.connection.execute(
+            'SELECT id, size, mtime_ns, offset, hash FROM files WHERE path = ?', (path,)).fetchone()
+
+    def _add_counts(self, file_id, counts):
+        self.connection.executemany(
+            'INSERT INTO counts (file_id, word, count) VALUES (?, ?, ?) '
+            'ON CONFLICT (file_id, word) DO UPDATE SET count = count + excluded.count',
+            ((file_id, word, count) for word, count in counts.items()))
+
+    def update(self, path, count_range):
+        """
+        Brings the entry of one file up to date.
+
+        Returns:
+            tuple: (file id, counted offset, file size); the bytes after the
+            offset belong to an unfinished last line and are not stored.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self._entry(path)
+        if entry != None and entry[1] == stat.st_size and entry[2] == stat.st_mtime_ns:
+            return entry[0], entry[3], stat.st_size
+
+        offset = last_line_end(path, stat.st_size)
+        with self.connection:
+            if entry != None and entry[3] <= offset:
+                # the file was appended to if the counted bytes did not change
+                file_id, _, _, counted, stored_hash = entry
+                prefix_hash, new_hash = hash_prefix(path, offset, counted)
+                if prefix_hash == stored_hash:
+                    if offset > counted:
+                        self._add_counts(file_id, count_range(path, counted, offset))
+                    self.connection.execute(
+                        'UPDATE files SET size = ?, mtime_ns = ?, offset = ?, hash = ? WHERE id = ?',
+                        (stat.st_size, stat.st_mtime_ns, offset, new_hash, file_id))
+                    return file_id, offset, stat.st_size
+
+            # new or rewritten file, everything is counted again
+            if entry != None:
+                self.connection.execute('DELETE FROM files WHERE id = ?', (entry[0],))
+            file_id = self.connection.execute(
+                'INSERT INTO files (path, size, mtime_ns, offset, hash) VALUES (?, ?, ?, ?, ?)',
+                (path, stat.st_size, stat.st_mtime_ns, offset, hash_prefix(path, offset))).lastrowid
+            if offset > 0:
+                self._add_counts(file_id, count_range(path, 0, offset))
+        return file_id, offset, stat.st_size
+
+    def counts(self, paths, count_range, minimal=0, excluded=frozenset()):
+        """
+        Word counts of all files, updating their entries first.
+
+        Returns:
+            Counter: word -> number of occurrences, words shorter than minimal
+            and excluded words left out.
+        """
+        total = Counter()
+        file_ids = []
+        for path in paths:
+            file_id, offset, size = self.update(path, count_range)
+            file_ids.append(file_id)
+            if offset < size:
+                total.update(count_range(path, offset, size))
+
+        placeholders = ', '.join('?' * len(file_ids))
+        rows = self.connection.execute(
+            f'SELECT word, SUM(count) FROM counts WHERE file_id IN ({placeholders}) '
+            f'AND length(word) >= ? GROUP BY word', (*file_ids, minimal))
+        total.update(dict(rows))
+
+        for word in list(total):
+            if len(word) < minimal or word in excluded:
+                del total[word]
+        return total
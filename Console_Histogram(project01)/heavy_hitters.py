@@ -0,0 +1,142 @@
+import heapq
+import math
+from array import array
+
+'''
+    Bounded-memory word counting for streams that do not fit an exact dictionary.
+
+    A Count-Min Sketch estimates the count of any word, a Space-Saving summary
+    keeps the candidates for the most frequent words. Both only ever use the
+    memory they were created with.
+'''
+
+# Rough size of one Space-Saving entry (dict slot, key string, list of two ints)
+ENTRY_BYTES = 300
+# Rough size of one (count, word) tuple of the lazy heap, which holds at most
+# HEAP_FACTOR entries per monitored word
+HEAP_ENTRY_BYTES = 100
+HEAP_FACTOR = 2
+
+
+class count_min_sketch:
+    """
+    Count-Min Sketch: depth rows of width counters, one counter per row and word.
+
+    The estimate (minimum over the rows) never underestimates. With probability
+    at least 1 - exp(-depth) it overestimates by at most e / width * total.
+    """
+    def __init__(self, width, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('Q', bytes(8 * width)) for _ in range(depth)]
+        self.total = 0
+
+    def _indexes(self, word):
+        # double hashing, the rows use h1 + i * h2
+        h = hash(word) & 0xFFFFFFFFFFFFFFFF
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, word, count=1):
+        self.total += count
+        estimate = None
+        for row, i in zip(self.rows, self._indexes(word)):
+            row[i] += count
+            if estimate is None or row[i] < estimate:
+                estimate = row[i]
+        return estimate
+
+    def estimate(self, word):
+        return min(row[i] for row, i in zip(self.rows, self._indexes(word)))
+
+    def error_bound(self):
+        """Largest overestimate, holding with probability 1 - exp(-depth)."""
+        return math.e / self.width * self.total
+
+
+class space_saving:
+    """
+    Space-Saving summary of at most `capacity` words.
+
+    A new word replaces the monitored word with the smallest count c and starts
+    at c + count with error c. For every monitored word the true count lies in
+    [count - error, count], every word more frequent than total / capacity is
+    monitored. The lazy heap is rebuilt when it reaches HEAP_FACTOR * capacity
+    entries, so the memory per monitored word stays bounded.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = {}
+        # (count, word) pairs, entries whose count changed are dropped lazily
+        self._heap = []
+
+    def add(self, word, count=1):
+        entry = self.entries.get(word)
+        if entry is not None:
+            entry[0] += count
+            heapq.heappush(self._heap, (entry[0], word))
+        elif len(self.entries) < self.capacity:
+            self.entries[word] = [count, 0]
+            heapq.heappush(self._heap, (count, word))
+        else:
+            minimum, evicted = self._pop_minimum()
+            del self.entries[evicted]
+            self.entries[word] = [minimum + count, minimum]
+            heapq.heappush(self._heap, (minimum + count, word))
+
+        if len(self._heap) >= HEAP_FACTOR * self.capacity:
+            self._heap = [(entry[0], key) for key, entry in self.entries.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_minimum(self):
+        while True:
+            count, word = heapq.heappop(self._heap)
+            entry = self.entries.get(word)
+            if entry is not None and entry[0] == count:
+                return count, word
+
+    def top(self, k):
+        """The k words with the largest counts, as (word, count, error)."""
+        best = heapq.nlargest(k, self.entries.items(), key=lambda item: item[1][0])
+        return [(word, count, error) for word, (count, error) in best]
+
+
+class heavy_hitters:
+    """
+    Approximate word counts in a fixed memory budget.
+
+    Half of the budget goes to a Count-Min Sketch, half to a Space-Saving
+    summary together with its heap. The budget does not cover the counts of
+    the text passed to update(), the caller reserves memory for those. Reported counts are the smaller of the two estimates, with the
+    interval in which the true count lies.
+
+    Attributes:
+        memory_bytes (int): Memory budget.
+        sketch (count_min_sketch): Estimates of all words.
+        summary (space_saving): Candidates for the most frequent words.
+    """
+    def __init__(self, memory_bytes, depth=4):
+        self.memory_bytes = memory_bytes
+        width = max(1, memory_bytes // 2 // (8 * depth))
+        self.sketch = count_min_sketch(width, depth)
+        self.summary = space_saving(max(1, memory_bytes // 2 // (ENTRY_BYTES + HEAP_FACTOR * HEAP_ENTRY_BYTES)))
+
+    def update(self, counts):
+        """Add a mapping word -> count, e.g. the Counter of one block of text."""
+        for word, count in counts.items():
+            self.sketch.add(word, count)
+            self.summary.add(word, count)
+
+    def top(self, k):
+        """
+        The k most frequent words as (word, estimate, lower, upper).
+
+        lower comes from the Space-Saving error, upper is the smaller of the
+        Space-Saving count and the Count-Min estimate.
+        """
+        result = []
+        for word, count, error in self.summary.top(k):
+            upper = min(count, self.sketch.estimate(word))
+            result.append((word, upper, count - error, upper))
+        return result
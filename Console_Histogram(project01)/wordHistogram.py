@@ -1,14 +1,55 @@
 import argparse
+import glob
+import math
+import os
 import random
-from collections import defaultdict
+import re
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from ascii_graph import Pyasciigraph
 from ascii_graph.colors import Red, Gre, Yel, Blu, Pur, Cya, Whi
+from heavy_hitters import heavy_hitters
+from count_index import count_index
 
 '''
     To start the program, use the command line:
-        python wordHistogram.py <filename> -hl <histlimit> -m <minimal> -el <excludedList>
+        python wordHistogram.py <filename> [<filename> ...] -hl <histlimit> -m <minimal> -el <excludedList>
+
+    Filenames may be glob patterns, e.g. "corpus/*.txt". Large files are split
+    into byte ranges ending on line boundaries and counted in parallel worker
+    processes, the partial counts are merged at the end.
+
+    A filename "-" reads standard input. With --approximate the words are
+    counted in a fixed memory budget (--memory, MB) by heavy_hitters, the
+    histogram then shows the interval of every count next to the word.
+
+    Exact counts of files are kept in a count index (--index, SQLite), so later
+    runs with other filters read only the index and a file that was appended
+    to is only counted from where the previous run stopped.
 '''
 
+# Default size of the byte range counted by one worker task
+CHUNK_SIZE = 64 * 1024 * 1024
+# Default file of the persistent count index
+INDEX_FILE = '.wordHistogram.sqlite'
+# Size of the blocks read from streams
+BLOCK_SIZE = 1024 * 1024
+# Smallest block of the approximate mode
+MIN_BLOCK_SIZE = 4096
+# Peak working memory of count_buffer per byte of a block (translated copy, token
+# list, counters), measured on text of short distinct words
+BLOCK_OVERHEAD = 32
+# Bytes bytes.split() splits on
+WHITESPACE = b' \t\n\r\x0b\x0c'
+
+# A word is a run of letters and digits, inner apostrophes and hyphens are kept ("don't", "well-known")
+WORD_PATTERN = re.compile(r"[^\W_]+(?:['’-][^\W_]+)*")
+# Byte table for the first pass over raw UTF-8: ASCII letters are lowercased, other ASCII
+# characters except digits, apostrophes and hyphens become spaces, bytes of multi-byte
+# characters are kept for the Unicode pass over the distinct tokens
+SEPARATOR_TABLE = bytes(c if c >= 128 or chr(c).isalnum() or chr(c) in "'-" else 32 for c in range(256)).lower()
+
 
 def random_color():
     """Return a random color object from ascii_graph.colors."""
@@ -16,40 +57,241 @@ def random_color():
     return random.choice(available_colors)
 
 
-# Parsing Arguments
-parser = argparse.ArgumentParser(description='Program processing a file to create histogram.')
-parser.add_argument('filename', help='Name of the file to process')
-parser.add_argument('-hl', '--histlimit', help='How many words will be shown', type=int, default=10)
-parser.add_argument('-m', '--minimal', help='Minimal length limit of processed words', type=int, default=0)
-parser.add_argument('-el', '--excludedList', help='List of excluded words', nargs='*', default=['', '—', ' ', '\n'])
-
-args = parser.parse_args()
-print(f'Processing file: {args.filename}')
-
-# Creating Directories
-defDict = defaultdict(int)
-with open(args.filename, 'r') as file:
-    for line in file:
-        words = line.split()
-        for word in words:
-            word = word.strip('.,!?";:()[]').lower()
-            if word not in args.excludedList:
-                if len(word) >= args.minimal:
-                    defDict[word] += 1
-
-sorted_by_values = dict(sorted(defDict.items(), key=lambda item: item[1], reverse=True))
-
-# Getting list for Grapth
-lst_graph = []
-for i in range(0, args.histlimit):
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Program processing a file to create histogram.')
+    parser.add_argument('filenames', metavar='filename', nargs='+',
+                        help='Names or glob patterns of the files to process')
+    parser.add_argument('-hl', '--histlimit', help='How many words will be shown', type=int, default=10)
+    parser.add_argument('-m', '--minimal', help='Minimal length limit of processed words', type=int, default=0)
+    parser.add_argument('-el', '--excludedList', help='List of excluded words', nargs='*', default=[])
+    parser.add_argument('-j', '--jobs', help='Number of worker processes, all cores by default', type=int, default=None)
+    parser.add_argument('-cs', '--chunkSize', help='Size of the byte ranges counted by one worker (MB)',
+                        type=int, default=CHUNK_SIZE // (1024 * 1024))
+    parser.add_argument('-a', '--approximate', help='Count in bounded memory, counts become intervals',
+                        action='store_true')
+    parser.add_argument('-mem', '--memory', help='Memory budget of the approximate mode (MB)', type=int, default=64)
+    parser.add_argument('-i', '--index', help='File of the persistent count index', default=INDEX_FILE)
+    parser.add_argument('--no-index', help='Count the files without reading or writing the index',
+                        action='store_true')
+    return parser.parse_args(argv)
+
+
+def expand_inputs(patterns):
+    """Return the files matching the given names or glob patterns, each file once."""
+    paths = []
+    for pattern in patterns:
+        if pattern == '-':
+            paths.append(pattern)
+            continue
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            raise FileNotFoundError(f'No file matches {pattern}')
+        for path in matches:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def chunk_ranges(path, chunk_size=CHUNK_SIZE, start=0, end=None):
+    """
+    Split the bytes start to end (the end of the file by default) of a file into
+    (path, start, end) byte ranges of about chunk_size bytes.
+
+    Every range except the last ends just after a newline, so no line (and no
+    multi-byte character) is cut between two ranges.
+    """
+    size = os.path.getsize(path) if end == None else end
+    ranges = []
+    with open(path, 'rb') as file:
+        while start < size:
+            stop = min(start + chunk_size, size)
+            if stop < size:
+                file.seek(stop)
+                file.readline()
+                stop = min(file.tell(), size)
+            ranges.append((path, start, stop))
+            start = stop
+    return ranges
+
+
+def utf8_boundary(buffer):
+    """Length of the longest prefix of buffer that does not end inside a UTF-8 character."""
+    i = len(buffer) - 1
+    while i > 0 and 0x80 <= buffer[i] < 0xC0:
+        i -= 1
+    if i < 0 or buffer[i] < 0x80:
+        return len(buffer)
+    length = 2 if buffer[i] < 0xE0 else 3 if buffer[i] < 0xF0 else 4
+    return len(buffer) if i + length <= len(buffer) else i
+
+
+def read_blocks(path, block_size=BLOCK_SIZE):
+    """
+    Yield the raw bytes of a file, or of standard input for "-", in blocks.
+
+    Reads are block_size bytes, the unfinished token at the end of a read is
+    carried into the next block. A token of block_size bytes or more is cut
+    (between two UTF-8 characters), so no block is longer than 2 * block_size
+    bytes, whatever the input looks like.
+    """
+    file = sys.stdin.buffer if path == '-' else open(path, 'rb')
     try:
-        key = list(sorted_by_values.keys())[i]
-        value = sorted_by_values[key]
-        lst_graph.append((key, value, random_color()))
-    except IndexError:
-        break
-
-# Creating Grapth
-graph = Pyasciigraph()
-for line in graph.graph(f'Top {args.histlimit} most common words in {args.filename}', lst_graph):
-    print(line)
+        carry = b''
+        while True:
+            data = file.read(block_size)
+            if not data:
+                break
+            buffer = carry + data
+            end = max(buffer.rfind(space) for space in WHITESPACE) + 1
+            if len(buffer) - end >= block_size:
+                end = utf8_boundary(buffer)
+            carry = buffer[end:]
+            yield buffer[:end]
+        if carry:
+            yield carry
+    finally:
+        if file is not sys.stdin.buffer:
+            file.close()
+
+
+def make_excluded(words):
+    """Frozenset of the case folded excluded words."""
+    return frozenset(word.casefold() for word in words)
+
+
+def count_buffer(buffer, minimal, excluded):
+    """
+    Count the words of a buffer of UTF-8 encoded text.
+
+    The whole buffer is lowercased and split on ASCII punctuation with one
+    bytes.translate call and the tokens are counted with Counter. Only the
+    distinct tokens that are not plain ASCII words are decoded, case folded and
+    split into words by WORD_PATTERN, so the em-dash, curly quotes and other
+    Unicode punctuation never end up in a word.
+    """
+    counts = Counter()
+    findall = WORD_PATTERN.findall
+    for token, count in Counter(buffer.translate(SEPARATOR_TABLE).split()).items():
+        if token.isalnum():
+            counts[token.decode('ascii')] += count
+        else:
+            for word in findall(token.decode('utf-8', errors='replace').casefold()):
+                counts[word] += count
+
+    if minimal > 0 or excluded:
+        counts = Counter({word: count for word, count in counts.items()
+                          if len(word) >= minimal and word not in excluded})
+    return counts
+
+
+def count_chunk(task):
+    """Count the words of one byte range, task = (path, start, end, minimal, excluded)."""
+    path, start, end, minimal, excluded = task
+    with open(path, 'rb') as file:
+        file.seek(start)
+        buffer = file.read(end - start)
+    return count_buffer(buffer, minimal, excluded)
+
+
+def count_tasks(tasks, jobs=None):
+    """Merged counts of count_chunk tasks, in parallel worker processes when there is more than one."""
+    total = Counter()
+    if len(tasks) <= 1 or jobs == 1:
+        for task in tasks:
+            total.update(count_chunk(task))
+        return total
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for counts in executor.map(count_chunk, tasks):
+            total.update(counts)
+    return total
+
+
+def count_words(paths, minimal=0, excluded=(), jobs=None, chunk_size=CHUNK_SIZE, index=None):
+    """
+    Word counts of all files, chunks are counted in parallel when there is more than one.
+
+    With a count_index the files are looked up in the index, only new files
+    and the bytes appended to known files are counted.
+
+    Returns:
+        Counter: word -> number of occurrences.
+    """
+    excluded = make_excluded(excluded)
+    files = [filename for filename in paths if filename != '-']
+
+    total = Counter()
+    if '-' in paths:
+        for buffer in read_blocks('-'):
+            total.update(count_buffer(buffer, minimal, excluded))
+
+    if index != None:
+        def count_range(path, start, end):
+            # the index stores unfiltered counts
+            return count_tasks([(path, chunk_start, chunk_end, 0, frozenset())
+                                for path, chunk_start, chunk_end in chunk_ranges(path, chunk_size, start, end)],
+                               jobs)
+        total.update(index.counts(files, count_range, minimal, excluded))
+        return total
+
+    tasks = [(path, start, end, minimal, excluded)
+             for filename in files
+             for path, start, end in chunk_ranges(filename, chunk_size)]
+    total.update(count_tasks(tasks, jobs))
+    return total
+
+
+def count_approximate(paths, minimal=0, excluded=(), memory_bytes=64 * 1024 * 1024):
+    """
+    Word counts of all files (or standard input) in a fixed memory budget.
+
+    Half of the budget goes to heavy_hitters, the other half to reading and
+    counting one block, the block size follows from BLOCK_OVERHEAD.
+
+    Returns:
+        heavy_hitters: Approximate counts, see heavy_hitters.top().
+    """
+    excluded = make_excluded(excluded)
+    counter = heavy_hitters(memory_bytes // 2)
+    block_size = max(MIN_BLOCK_SIZE, memory_bytes // 2 // BLOCK_OVERHEAD)
+    for path in paths:
+        for buffer in read_blocks(path, block_size):
+            counter.update(count_buffer(buffer, minimal, excluded))
+    return counter
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    paths = expand_inputs(args.filenames)
+    title = ', '.join(paths)
+    print(f'Processing file: {title}')
+
+    if args.approximate:
+        # Counting words in bounded memory, every label shows the interval of the true count
+        counter = count_approximate(paths, args.minimal, args.excludedList, args.memory * 1024 * 1024)
+        lst_graph = [(f'{key} [{lower}-{upper}]', value, random_color())
+                     for key, value, lower, upper in counter.top(max(args.histlimit, 0))]
+        print(f'Approximate counts of {counter.sketch.total} words, '
+              f'any count is overestimated by at most {counter.sketch.error_bound():.0f} '
+              f'with probability {1 - math.exp(-counter.sketch.depth):.3f}')
+    else:
+        # Counting words, files already in the index are not read again
+        index = None if args.no_index else count_index(args.index)
+        try:
+            defDict = count_words(paths, args.minimal, args.excludedList, args.jobs, args.chunkSize * 1024 * 1024,
+                                  index)
+        finally:
+            if index != None:
+                index.close()
+
+        # Getting list for Grapth, most_common(k) selects with a heap instead of sorting every word
+        lst_graph = [(key, value, random_color()) for key, value in defDict.most_common(max(args.histlimit, 0))]
+
+    # Creating Grapth
+    graph = Pyasciigraph()
+    for line in graph.graph(f'Top {args.histlimit} most common words in {title}', lst_graph):
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
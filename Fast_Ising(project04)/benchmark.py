@@ -0,0 +1,199 @@
+import argparse
+import itertools
+import json
+import platform
+import time
+import numpy as np
+import numba
+from ising import ising_simulation
+from ising_numba import ising_simulation_numba
+from ising_packed import ising_simulation_packed
+from ising_lattice import ising_simulation_lattice, square_lattice
+from ising_tempering import parallel_tempering
+from ising_analysis import blocking_error
+
+
+class tempering_replica:
+    """
+    Single-temperature parallel_tempering run with the interface of the other engines.
+
+    With one beta there is nothing to exchange, so this times the replica sweep
+    kernel alone and checks it against the other engines.
+    """
+    def __init__(self, size, beta, seed, ups_density):
+        self.pt = parallel_tempering(size, 1, [beta], 0, 0, ups_density=ups_density, seed=seed)
+
+    def big_step(self):
+        self.pt.big_step()
+
+    def calculate_M(self):
+        return float(self.pt.calculate_M()[0])
+
+
+# engine name -> (constructor(size, beta, seed, ups_density), size check, uses numba threads)
+# The numpy checkerboard of Simple_Ising(project02) is not included: it is a separate
+# project whose module is also named ising, and its sweep is the same algorithm as
+# the 'checkerboard' engine here.
+ENGINES = {'numpy_random': (lambda size, beta, seed, ups: ising_simulation(
+                                size, 1, beta, 0, 0, ups, seed=seed),
+                            lambda size: True, False),
+           'numba_random': (lambda size, beta, seed, ups: ising_simulation_numba(
+                                size, 1, beta, 0, 0, ups, seed=seed),
+                            lambda size: True, False),
+           'checkerboard': (lambda size, beta, seed, ups: ising_simulation_numba(
+                                size, 1, beta, 0, 0, ups, seed=seed, engine='checkerboard'),
+                            lambda size: size % 2 == 0, True),
+           'wolff': (lambda size, beta, seed, ups: ising_simulation_numba(
+                         size, 1, beta, 0, 0, ups, seed=seed, engine='wolff'),
+                     lambda size: True, False),
+           'swendsen_wang': (lambda size, beta, seed, ups: ising_simulation_numba(
+                                 size, 1, beta, 0, 0, ups, seed=seed, engine='swendsen_wang'),
+                             lambda size: True, False),
+           'packed': (lambda size, beta, seed, ups: ising_simulation_packed(
+                          size, 1, beta, 0, 0, ups, seed=seed),
+                      lambda size: size % 64 == 0, True),
+           'lattice_square': (lambda size, beta, seed, ups: ising_simulation_lattice(
+                                  square_lattice(size), beta, 0, 0, ups, seed=seed),
+                              lambda size: size % 2 == 0, True),
+           'tempering': (tempering_replica, lambda size: size % 2 == 0, False)}
+
+
+def run_case(engine, size, threads, beta, sweeps, equilibration, seed, ups_density = 1.0):
+    """
+    Times `sweeps` big steps of one engine after `equilibration` untimed ones.
+
+    Every engine does one update attempt per site and sweep (cluster engines one
+    sweep of cluster moves), so the throughput is reported as attempts per second.
+    The default ordered start lets the local engines reach equilibrium in the
+    low temperature phase, a random start leaves them in long-lived domain states.
+
+    Returns:
+        dict: Parameters, timing and the mean of |M| with its blocking error.
+    """
+    make, _, threaded = ENGINES[engine]
+    if threaded:
+        numba.set_num_threads(threads)
+    sim = make(size, beta, seed, ups_density)
+    for _ in range(equilibration):
+        sim.big_step()
+
+    abs_M = np.empty(sweeps)
+    elapsed = 0.0
+    for step in range(sweeps):
+        start = time.perf_counter()
+        sim.big_step()
+        elapsed += time.perf_counter() - start
+        abs_M[step] = abs(sim.calculate_M())
+
+    error, converged = blocking_error(abs_M)
+    return {'engine': engine,
+            'size': size,
+            'threads': threads,
+            'beta': beta,
+            'sweeps': sweeps,
+            'seconds': elapsed,
+            'attempts_per_second': sweeps * size * size / elapsed,
+            'abs_M': float(abs_M.mean()),
+            'abs_M_error': float(error),
+            'error_converged': bool(converged)}
+
+
+def compare_engines(results, z_limit = 4.0):
+    """
+    Pairwise z-test of <|M|> between engines at equal size and beta.
+
+    Each engine contributes its run with the fewest threads.
+
+    A pair without a usable error (zero or not finite) cannot be tested, it
+    gets z = None, agree = None and the reason.
+
+    Returns:
+        list of dict: One entry per pair with z and agree = z <= z_limit.
+    """
+    comparisons = []
+    keys = sorted({(row['size'], row['beta']) for row in results})
+    for size, beta in keys:
+        rows = {}
+        for row in results:
+            if row['size'] == size and row['beta'] == beta:
+                if row['engine'] not in rows or row['threads'] < rows[row['engine']]['threads']:
+                    rows[row['engine']] = row
+        for a, b in itertools.combinations(sorted(rows), 2):
+            error = np.hypot(rows[a]['abs_M_error'], rows[b]['abs_M_error'])
+            if not np.isfinite(error) or error <= 0:
+                comparisons.append({'size': size, 'beta': beta, 'engines': [a, b],
+                                    'z': None, 'agree': None,
+                                    'reason': f"combined error of <|M|> is {error}"})
+                continue
+            z = abs(rows[a]['abs_M'] - rows[b]['abs_M']) / error
+            comparisons.append({'size': size, 'beta': beta, 'engines': [a, b],
+                                'z': float(z), 'agree': bool(z <= z_limit)})
+    return comparisons
+
+
+def environment():
+    return {'python': platform.python_version(),
+            'numpy': np.__version__,
+            'numba': numba.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'numba_threads': numba.config.NUMBA_NUM_THREADS}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the Ising engines in spin-flip attempts per second.")
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[64, 128])
+    parser.add_argument('--threads', nargs='+', type=int, default=[1])
+    parser.add_argument('--betas', nargs='+', type=float, default=[0.3, 0.44, 0.6])
+    parser.add_argument('--sweeps', type=int, default=500, help="timed sweeps per case")
+    parser.add_argument('--equilibration', type=int, default=200, help="untimed sweeps before timing")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ups-density', type=float, default=1.0, help="initial density of up spins")
+    parser.add_argument('--z-limit', type=float, default=4.0, help="largest z-score counted as agreement")
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--strict', action='store_true', help="exit with status 1 if engines disagree or a pair cannot be tested")
+    args = parser.parse_args(argv)
+
+    for threads in args.threads:
+        if threads > numba.config.NUMBA_NUM_THREADS:
+            parser.error(f"At most {numba.config.NUMBA_NUM_THREADS} threads are available.")
+
+    # compile every engine before anything is timed
+    for engine in args.engines:
+        ENGINES[engine][0](64, 0.5, args.seed, 0.5).big_step()
+
+    results = []
+    for engine, size, threads, beta in itertools.product(args.engines, args.sizes, args.threads, args.betas):
+        make, supported, threaded = ENGINES[engine]
+        if not supported(size) or (not threaded and threads != min(args.threads)):
+            continue
+        row = run_case(engine, size, threads, beta, args.sweeps, args.equilibration, args.seed,
+                       args.ups_density)
+        results.append(row)
+        print(f"{engine:>15} N={size:<5} threads={threads:<3} beta={beta:<5} "
+              f"{row['attempts_per_second']:>12.4g} attempts/s  <|M|>={row['abs_M']:.4f}+-{row['abs_M_error']:.4f}")
+
+    comparisons = compare_engines(results, args.z_limit)
+    failed = [c for c in comparisons if c['agree'] == False]
+    untested = [c for c in comparisons if c['agree'] == None]
+    for c in failed:
+        print(f"disagreement N={c['size']} beta={c['beta']}: {c['engines'][0]} vs {c['engines'][1]}, z={c['z']:.2f}")
+    for c in untested:
+        print(f"not tested N={c['size']} beta={c['beta']}: {c['engines'][0]} vs {c['engines'][1]}, {c['reason']}")
+    agreed = len(comparisons) - len(failed) - len(untested)
+    print(f"{agreed}/{len(comparisons)} engine pairs agree on <|M|>, {len(untested)} could not be tested")
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(),
+                   'arguments': vars(args),
+                   'results': results,
+                   'comparisons': comparisons}, f, indent=2)
+
+    if args.strict and (failed or untested):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
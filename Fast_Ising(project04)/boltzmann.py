@@ -0,0 +1,77 @@
+import numpy as np
+
+
+def boltzmann_table(j, beta, force_B):
+    """
+    Metropolis acceptance probabilities for a single spin flip.
+
+    With four nearest neighbours the energy change of flipping s_i is
+    2 * s_i * (j * sum_of_neighbours + force_B), which takes only 10 values.
+    The entry for a spin s_i with neighbour sum n is stored at
+    table_index(s_i, n).
+
+    Returns:
+        np.ndarray: Array of 10 probabilities min(1, exp(-beta * delta_E)).
+    """
+    s_i = np.repeat([-1, 1], 5)
+    neighbours = np.tile([-4, -2, 0, 2, 4], 2)
+    delta_E = 2 * s_i * (j * neighbours + force_B)
+    return np.exp((-1) * beta * np.maximum(delta_E, 0.0))
+
+
+def table_index(s_i, neighbours):
+    return 5 * (s_i > 0) + (neighbours + 4) // 2
+
+
+class boltzmann_acceptance:
+    """
+    Mixin of the single-spin-flip simulations with a running energy.
+
+    j and force_B are properties: assigning a new value rescales the running
+    hamiltionian right away, so it stays valid when they are changed between
+    sweeps. acceptance_table() returns the boltzmann_table of the current j,
+    beta and force_B and rebuilds it only when one of them changed.
+
+    The class using it sets j, beta, force_B, hamiltionian, total_spin,
+    _table = None and _table_key = None and has recalculate_observables().
+    """
+    @property
+    def j(self):
+        return self._j
+
+    @j.setter
+    def j(self, value):
+        old_j = self.__dict__.get('_j')
+        self._j = value
+        self._rescale_hamiltionian(old_j, self.__dict__.get('_force_B'))
+
+
+    @property
+    def force_B(self):
+        return self._force_B
+
+    @force_B.setter
+    def force_B(self, value):
+        old_force_B = self.__dict__.get('_force_B')
+        self._force_B = value
+        self._rescale_hamiltionian(self.__dict__.get('_j'), old_force_B)
+
+
+    def _rescale_hamiltionian(self, old_j, old_force_B):
+        if 'hamiltionian' not in self.__dict__ or old_j == None or old_force_B == None:
+            return  # still in __init__, the observables are computed later
+        if old_j == self.j and old_force_B == self.force_B:
+            return
+        if old_j == 0:
+            self.recalculate_observables()
+            return
+        bond_energy = self.hamiltionian + old_force_B * self.total_spin
+        self.hamiltionian = bond_energy * self.j / old_j - self.force_B * self.total_spin
+
+
+    def acceptance_table(self):
+        key = (self.j, self.beta, self.force_B)
+        if key != self._table_key:
+            self._table = boltzmann_table(self.j, self.beta, self.force_B)
+            self._table_key = key
+        return self._table
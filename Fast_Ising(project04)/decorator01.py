@@ -1,5 +1,604 @@
+import collections
+import functools
+import inspect
+import json
+import math
+import os
+import random
+import statistics
+import threading
 import time
-import numpy as np
+import weakref
+
+
+# Instrumentation switch. With TIMER_DECORATOR_DISABLE=1 in the environment, or
+# after set_enabled(False), newly decorated functions are returned unchanged and
+# already decorated ones only count their calls.
+_enabled = os.environ.get('TIMER_DECORATOR_DISABLE', '') in ('', '0')
+# functions returned unchanged because instrumentation was off, see print_stats()
+_untimed_functions = weakref.WeakSet()
+
+
+def set_enabled(enabled):
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def is_enabled():
+    return _enabled
+
+
+def _untimed(func):
+    try:
+        _untimed_functions.add(func)
+    except TypeError:
+        pass  # e.g. builtins, they are not weakly referenceable
+    return func
+
+
+def print_stats(func):
+    """
+    Prints the statistics of a decorated function or method, also when it was
+    decorated while instrumentation was off and so has no statistics.
+    """
+    if getattr(func, '__func__', func) in _untimed_functions:
+        print("Timing disabled.")
+        return
+    func.print_stats()
+
+
+class latency_histogram:
+    """
+        Fixed-memory streaming histogram of durations in nanoseconds, for quantiles.
+
+        Buckets are log-linear as in an HDR histogram: every power of two is
+        split into 2**precision_bits equal sub-buckets, so any recorded value
+        is known to a relative error of at most 2**-precision_bits (about 3 %
+        for the default 5 bits). Values up to 2**64 ns fit into
+        (65 - precision_bits) * 2**precision_bits counters, whatever the
+        number of samples.
+
+        Parameters
+        ----------
+        precision_bits : int
+            Number of significant bits kept of every value.
+    """
+    def __init__(self, precision_bits=5):
+        self.precision_bits = precision_bits
+        self.counts = [0] * ((65 - precision_bits) << precision_bits)
+        self.count = 0
+
+    def _value(self, index):
+        # midpoint of the bucket
+        shift = (index >> self.precision_bits) - 1
+        if shift <= 0:
+            return float(index)
+        mantissa = index - (shift << self.precision_bits)
+        return (mantissa + 0.5) * (1 << shift)
+
+    def record(self, value):
+        shift = value.bit_length() - self.precision_bits - 1
+        if shift <= 0:
+            self.counts[value] += 1
+        else:
+            self.counts[(shift << self.precision_bits) + (value >> shift)] += 1
+        self.count += 1
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            if c:
+                self.counts[i] += c
+        self.count += other.count
+
+    def quantile(self, q):
+        """
+        Value below which a fraction q of the recorded durations lies, in nanoseconds.
+        """
+        if self.count == 0:
+            return float('nan')
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self._value(i)
+        return self._value(len(self.counts) - 1)
+
+
+class timer_stats:
+    """
+        Execution time statistics of one stream of calls.
+
+        Mean and variance are updated with Welford's algorithm, the durations
+        are integer nanoseconds. Two timer_stats are combined with merge(),
+        which uses the pairwise update of Chan et al., so statistics collected
+        separately (e.g. per thread) merge without loss.
+
+        With sampling only some of the calls are timed, `calls` counts all of
+        them and the total time is extrapolated from the timed sample.
+
+        Attributes
+        ----------
+        calls : int
+            Number of calls, timed or not.
+        counter : int
+            Number of recorded (timed) calls.
+        total_time, mean_time, std_time, min_time, max_time : float
+            Statistics of the recorded durations (in seconds).
+        histogram : latency_histogram
+            Fixed-size histogram of all durations, for percentiles.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.counter = 0
+        self._total_ns = 0
+        self._mean_ns = 0.0
+        self._m2_ns = 0.0
+        self._min_ns = 1 << 64
+        self._max_ns = -1
+        self.histogram = latency_histogram()
+
+    def record(self, elapsed):
+        # Welford's update, no cancellation between large sums for short functions
+        self.counter += 1
+        self._total_ns += elapsed
+        delta = elapsed - self._mean_ns
+        self._mean_ns += delta / self.counter
+        self._m2_ns += delta * (elapsed - self._mean_ns)
+        if elapsed < self._min_ns:
+            self._min_ns = elapsed
+        if elapsed > self._max_ns:
+            self._max_ns = elapsed
+        self.histogram.record(elapsed)
+
+    def reset(self):
+        self.__init__()
+
+    def to_dict(self):
+        """
+        Plain (JSON and pickle friendly) form of the statistics, see from_dict().
+        """
+        return {'calls': self.calls,
+                'counter': self.counter,
+                'total_ns': self._total_ns,
+                'mean_ns': self._mean_ns,
+                'm2_ns': self._m2_ns,
+                'min_ns': self._min_ns,
+                'max_ns': self._max_ns,
+                'precision_bits': self.histogram.precision_bits,
+                'histogram': {str(i): c for i, c in enumerate(self.histogram.counts) if c}}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.calls = data['calls']
+        stats.counter = data['counter']
+        stats._total_ns = data['total_ns']
+        stats._mean_ns = data['mean_ns']
+        stats._m2_ns = data['m2_ns']
+        stats._min_ns = data['min_ns']
+        stats._max_ns = data['max_ns']
+        stats.histogram = latency_histogram(data['precision_bits'])
+        for i, c in data['histogram'].items():
+            stats.histogram.counts[int(i)] = c
+        stats.histogram.count = data['counter']
+        return stats
+
+    def summary(self):
+        """
+        Statistics in seconds, for reports.
+        """
+        low, high = self.total_time_interval()
+        return {'calls': self.calls,
+                'timed': self.counter,
+                'total': self.estimated_total_time,
+                'total_low': low,
+                'total_high': high,
+                'mean': self.mean_time,
+                'std': self.std_time,
+                'min': self.min_time,
+                'max': self.max_time,
+                'p50': self.percentile(50),
+                'p95': self.percentile(95),
+                'p99': self.percentile(99)}
+
+    def merge(self, other):
+        if other.counter == 0:
+            self.calls += other.calls
+            return
+        n = self.counter + other.counter
+        delta = other._mean_ns - self._mean_ns
+        self._mean_ns += delta * other.counter / n
+        self._m2_ns += other._m2_ns + delta * delta * self.counter * other.counter / n
+        self.counter = n
+        self.calls += other.calls
+        self._total_ns += other._total_ns
+        self._min_ns = min(self._min_ns, other._min_ns)
+        self._max_ns = max(self._max_ns, other._max_ns)
+        self.histogram.merge(other.histogram)
+
+    @property
+    def total_time(self):
+        return self._total_ns * 1e-9
+
+    @property
+    def mean_time(self):
+        return self._mean_ns * 1e-9
+
+    @property
+    def estimated_total_time(self):
+        """
+        Total time of all calls, extrapolated from the timed ones (exact without sampling).
+        """
+        return self.mean_time * max(self.calls, self.counter)
+
+    def total_time_interval(self, confidence=0.95):
+        """
+        Confidence interval of estimated_total_time in seconds.
+
+        Uses the normal approximation of the mean of the timed calls with the
+        finite population correction, so the interval shrinks to a point when
+        every call is timed.
+        """
+        calls = max(self.calls, self.counter)
+        estimate = self.estimated_total_time
+        if self.counter < 2:
+            return (estimate, estimate) if self.counter == calls else (0.0, float('inf'))
+        z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+        error = z * calls * self.std_time / math.sqrt(self.counter) \
+                  * math.sqrt(1 - self.counter / calls)
+        return max(estimate - error, 0.0), estimate + error
+
+    @property
+    def std_time(self):
+        if self.counter < 2:
+            return 0.0
+        return math.sqrt(self._m2_ns / self.counter) * 1e-9
+
+    @property
+    def min_time(self):
+        return float('inf') if self.counter == 0 else self._min_ns * 1e-9
+
+    @property
+    def max_time(self):
+        return float('-inf') if self.counter == 0 else self._max_ns * 1e-9
+
+    def percentile(self, p):
+        """
+        p-th percentile of the execution time in seconds, e.g. percentile(99).
+        """
+        if self.counter == 0:
+            return float('nan')
+        # bucket midpoints can lie outside the observed range
+        value = min(max(self.histogram.quantile(p / 100), self._min_ns), self._max_ns)
+        return value * 1e-9
+
+    def print_stats(self):
+        if self.counter == 0:
+            print("No runs yet.")
+            return
+
+        print(f"runs: {self.counter}")
+        if self.calls > self.counter:
+            low, high = self.total_time_interval()
+            print(f"calls (all, sampled): {self.calls}")
+            print(f"estimated total (s): {self.estimated_total_time:.6g} (95% CI {low:.6g} - {high:.6g})")
+        print(f"average (s): {self.mean_time:.6g}")
+        print(f"std (s): {self.std_time:.6g}")
+        print(f"min (s): {self.min_time:.6g}")
+        print(f"max (s): {self.max_time:.6g}")
+        for p in (50, 95, 99):
+            print(f"p{p} (s): {self.percentile(p):.6g}")
+
+
+class sharded_stats:
+    """
+        timer_stats kept separately for every thread and merged when read.
+
+        Each thread records into its own timer_stats found through
+        threading.local, so calls never take a lock; the lock is only taken
+        when a thread records for the first time and when the shards are read.
+        Shards of finished threads are kept, their calls still count.
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+
+    def local(self):
+        try:
+            return self._local.stats
+        except AttributeError:
+            stats = timer_stats()
+            self._local.stats = stats
+            with self._lock:
+                self._shards.append(stats)
+            return stats
+
+    def merged(self):
+        total = timer_stats()
+        with self._lock:
+            shards = list(self._shards)
+        for stats in shards:
+            total.merge(stats)
+        return total
+
+    def reset(self):
+        with self._lock:
+            for stats in self._shards:
+                stats.reset()
+
+
+def _dropped_proxy():
+    return None
+
+
+class bound_timer:
+    """
+        TimerDecorator bound to one instance, returned for `instance.method`.
+
+        It is created on the first access and cached in the instance __dict__
+        under a private key, later accesses and calls allocate nothing. Like a
+        bound method it keeps its instance alive, so `make().method()` works on
+        a temporary; the cached proxy forms a reference cycle with the instance,
+        which the garbage collector frees once the instance is dropped. Pickling
+        or copying the instance drops the proxy. Attributes like
+        print_stats are forwarded to the decorator, so they report all
+        instances together; instance_stats() and print_instance_stats() report
+        this instance alone (per_instance=True).
+    """
+    __slots__ = ('_decorator', '_instance', '_stats')
+
+    def __init__(self, decorator, instance):
+        self._decorator = decorator
+        self._instance = instance
+        self._stats = sharded_stats() if decorator.per_instance else None
+
+    def __call__(self, *args, **kwargs):
+        return self._decorator._timed(self._stats, self._instance, *args, **kwargs)
+
+    def __getattr__(self, name):
+        # Forward attributes (like print_stats, counter, etc.)
+        return getattr(self._decorator, name)
+
+    def __reduce__(self):
+        # copies of the instance get a new proxy on their first access
+        return _dropped_proxy, ()
+
+    def instance_stats(self):
+        if self._stats is None:
+            raise ValueError("Per-instance statistics need TimerDecorator(func, per_instance=True).")
+        return self._stats.merged()
+
+    def print_instance_stats(self):
+        self.instance_stats().print_stats()
+
+
+class _span:
+    # node of the per-thread call tree of timed functions
+    __slots__ = ('name', 'children', 'stats')
+
+    def __init__(self, name):
+        self.name = name
+        self.children = {}
+        self.stats = timer_stats()
+
+
+def _json_summary(stats):
+    # statistics without timed calls are inf or nan, which is not valid JSON
+    return {key: value if not isinstance(value, float) or math.isfinite(value) else None
+            for key, value in stats.summary().items()}
+
+
+class timer_registry:
+    """
+        Process-wide collection of the statistics of every TimerDecorator.
+
+        Besides the flat statistics per function, the registry can keep a
+        call tree of nested timed calls per thread (e.g. simulate -> big_step),
+        the "spans", identified by their path 'outer;inner'. Spans cost about
+        as much as the function statistics themselves, so they are only
+        collected after start_spans(). With start_trace() spans are collected
+        and every call is also kept as an event in a bounded buffer, for the
+        Chrome trace export (chrome://tracing, Perfetto).
+
+        Statistics of other processes are combined with merge(): a worker
+        returns registry.snapshot(), a plain dict, and the parent merges it.
+        A forked worker inherits the statistics of its parent, call reset()
+        at the start of its work.
+
+        Async functions are recorded as children of the span active when they
+        are called, but do not become the parent of the calls they make.
+
+        Methods:
+            register(name, timer): Called by every TimerDecorator.
+            start_spans(): Starts collecting the call tree.
+            stop_spans(): Stops collecting the call tree, unless a trace is running.
+            start_trace(max_events=100000): Starts keeping call events, the oldest are dropped when full.
+            stop_trace(): Stops keeping call events.
+            function_stats(): Merged timer_stats of every function.
+            span_stats(): Merged timer_stats of every call path.
+            snapshot(): Everything above as a plain dict, to send to another process.
+            merge(snapshot): Adds a snapshot of another process.
+            reset(): Clears all statistics and events.
+            export_json(filename): Writes a summary of functions and spans.
+            export_chrome_trace(filename): Writes the call events in Chrome trace format.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._timers = {}
+        self._roots = []
+        self._imported_functions = {}
+        self._imported_spans = {}
+        self._events = None
+        self._imported_events = collections.deque()
+        self._pid = os.getpid()
+        self._spans = False
+        # read by every timed call, True while spans or a trace are collected
+        self.active = False
+
+    def register(self, name, timer):
+        with self._lock:
+            self._timers.setdefault(name, []).append(timer)
+
+    def _current(self):
+        try:
+            return self._local.current
+        except AttributeError:
+            root = _span(None)
+            self._local.current = root
+            with self._lock:
+                self._roots.append(root)
+            return root
+
+    def _child(self, parent, name):
+        node = parent.children.get(name)
+        if node is None:
+            node = _span(name)
+            parent.children[name] = node
+        return node
+
+    def enter(self, name):
+        """
+        Makes `name` the active span of this thread, returns (parent, span) for leave() and record().
+        """
+        parent = self._current()
+        node = self._child(parent, name)
+        self._local.current = node
+        return parent, node
+
+    def leave(self, parent):
+        self._local.current = parent
+
+    def child(self, name):
+        # span below the active one that does not become active itself
+        return self._child(self._current(), name)
+
+    def record(self, node, start, elapsed):
+        node.stats.calls += 1
+        node.stats.record(elapsed)
+        if self._events is not None:
+            self._events.append((node.name, start, elapsed, self._pid, threading.get_ident()))
+
+    def start_spans(self):
+        self._spans = True
+        self.active = True
+
+    def stop_spans(self):
+        self._spans = False
+        self.active = self._events is not None
+
+    def start_trace(self, max_events=100000):
+        self._pid = os.getpid()
+        self._events = collections.deque(maxlen=max_events)
+        self._imported_events = collections.deque(maxlen=max_events)
+        self.active = True
+
+    def stop_trace(self):
+        self._events = None
+        self.active = self._spans
+
+    def function_stats(self):
+        result = {}
+        with self._lock:
+            timers = {name: list(group) for name, group in self._timers.items()}
+        for name, group in timers.items():
+            stats = timer_stats()
+            for timer in group:
+                stats.merge(timer.stats())
+            result[name] = stats
+        for name, imported in self._imported_functions.items():
+            result.setdefault(name, timer_stats()).merge(imported)
+        return result
+
+    def span_stats(self):
+        result = {}
+
+        def walk(node, path):
+            for name, child in list(node.children.items()):
+                child_path = path + (name,)
+                result.setdefault(child_path, timer_stats()).merge(child.stats)
+                walk(child, child_path)
+
+        with self._lock:
+            roots = list(self._roots)
+        for root in roots:
+            walk(root, ())
+        for path, imported in self._imported_spans.items():
+            result.setdefault(path, timer_stats()).merge(imported)
+        return result
+
+    def _all_events(self):
+        events = list(self._imported_events)
+        if self._events is not None:
+            events.extend(self._events)
+        return events
+
+    def snapshot(self):
+        return {'functions': {name: stats.to_dict() for name, stats in self.function_stats().items()},
+                'spans': {';'.join(path): stats.to_dict() for path, stats in self.span_stats().items()},
+                'events': [list(event) for event in self._all_events()]}
+
+    def merge(self, snapshot):
+        for name, data in snapshot['functions'].items():
+            self._imported_functions.setdefault(name, timer_stats()).merge(timer_stats.from_dict(data))
+        for path, data in snapshot['spans'].items():
+            key = tuple(path.split(';'))
+            self._imported_spans.setdefault(key, timer_stats()).merge(timer_stats.from_dict(data))
+        self._imported_events.extend(tuple(event) for event in snapshot['events'])
+
+    def reset(self):
+        """
+        Clears the statistics, call it while no timed function is running.
+        """
+        with self._lock:
+            timers = [timer for group in self._timers.values() for timer in group]
+            roots = list(self._roots)
+        for timer in timers:
+            timer.reset()
+
+        def clear(node):
+            for child in node.children.values():
+                child.stats.reset()
+                clear(child)
+
+        for root in roots:
+            clear(root)
+        self._imported_functions = {}
+        self._imported_spans = {}
+        self._pid = os.getpid()
+        if self._events is not None:
+            self._events.clear()
+        self._imported_events.clear()
+
+    def export_json(self, filename):
+        span_stats = self.span_stats()
+        spans = []
+        for path, stats in sorted(span_stats.items()):
+            # self time is the time not spent in timed children
+            children_total = sum(other.total_time for other_path, other in span_stats.items()
+                                 if other_path[:-1] == path)
+            spans.append({'path': ';'.join(path),
+                          'depth': len(path) - 1,
+                          'self': stats.total_time - children_total,
+                          **_json_summary(stats)})
+        with open(filename, 'w') as f:
+            json.dump({'functions': {name: _json_summary(stats) for name, stats in self.function_stats().items()},
+                       'spans': spans}, f, indent=2, allow_nan=False)
+
+    def export_chrome_trace(self, filename):
+        events = self._all_events()
+        origin = min((event[1] for event in events), default=0)
+        trace = [{'name': name, 'ph': 'X', 'ts': (start - origin) / 1000, 'dur': elapsed / 1000,
+                  'pid': pid, 'tid': tid}
+                 for name, start, elapsed, pid, tid in events]
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+
+registry = timer_registry()
+
 
 class TimerDecorator:
     """
@@ -10,27 +609,65 @@ class TimerDecorator:
         time, standard deviation, minimum, and maximum durations.
 
         The implementation is memory-efficient, it does not store each time 
-        seperatly.
+        seperatly. Times are taken with the monotonic time.perf_counter_ns,
+        mean and variance are updated with Welford's algorithm and the
+        percentiles come from a fixed-size latency_histogram.
+
+        Every thread records into its own statistics (see sharded_stats), the
+        attributes below merge them when read, so the decorated function can
+        run in a thread pool. An `async def` function is timed from the call
+        to the end of the awaited coroutine, including the time it is suspended.
+
+        Every decorator also reports to the process-wide `registry` under the
+        qualified name of the function, which adds export and, after
+        registry.start_spans() or registry.start_trace(), nested spans and
+        traces (see timer_registry).
+
+        For tiny hot functions the timing itself costs as much as the call,
+        sample_every or sample_rate time only a part of the calls; the other
+        calls only increment a counter and the total time is extrapolated with
+        a confidence interval. Options are given as @TimerDecorator(sample_every=100),
+        plain @TimerDecorator times every call. When instrumentation is switched
+        off (set_enabled(False) or TIMER_DECORATOR_DISABLE=1) decorating returns
+        the function itself, report it with the module level print_stats(func).
 
         Parameters
         ----------
         func : callable
             The function to be wrapped and timed.
+        per_instance : bool
+            On methods, also keep statistics of every instance separately,
+            read with instance.method.instance_stats(). With sampling they
+            only count the timed calls.
+        sample_every : int
+            Time only every sample_every-th call of each thread (the first one included).
+        sample_rate : float
+            Time every call with this probability, independent of sample_every.
 
         Attributes
         ----------
         func : callable
             The wrapped function being monitored.
-        counter : int
+        qualname : str
+            Name of the function in the registry, e.g. 'ising_simulation_numba.big_step'.
+        calls : int
             Number of times the decorated function has been called.
+        counter : int
+            Number of timed calls, equal to calls without sampling.
         total_time : float
             Cumulative sum of all recorded execution times (in seconds).
-        total_squared_time : float
-            Cumulative sum of squared execution times (used for variance computation).
+        estimated_total_time : float
+            Total time of all calls, extrapolated from the timed ones (in seconds).
+        mean_time : float
+            Running mean of the execution times, updated with Welford's algorithm (in seconds).
+        std_time : float
+            Standard deviation of the execution times (in seconds).
         min_time : float
             Minimum recorded execution time.
         max_time : float
             Maximum recorded execution time.
+        histogram : latency_histogram
+            Fixed-size histogram of all execution times, for percentiles.
 
         Examples
         --------
@@ -47,67 +684,177 @@ class TimerDecorator:
         std (s): 0.0005
         min (s): 0.1993
         max (s): 0.2010
+        p50 (s): 0.2003
+        p95 (s): 0.2003
+        p99 (s): 0.2003
     """
-    def __init__(self, func):
+    def __new__(cls, func=None, **options):
+        if func is None:
+            # used with options, @TimerDecorator(sample_every=100)
+            return lambda func: cls(func, **options)
+        if not _enabled:
+            return _untimed(func)
+        return super().__new__(cls)
+
+    def __init__(self, func, per_instance=False, sample_every=1, sample_rate=None):
+        if sample_every < 1:
+            raise ValueError("sample_every must be at least 1.")
         self.func = func
-        self.counter = 0
-        self.total_time = 0.0
-        self.total_squared_time = 0.0
-        self.min_time = float('inf')
-        self.max_time = float('-inf')
+        self.per_instance = per_instance
+        self.sample_every = sample_every
+        self.sample_rate = sample_rate
+        self.name = getattr(func, '__name__', None)
+        # key of the bound_timer cached in instance __dicts, see __get__
+        self._key = f'_timer_{self.name}'
+        self._is_async = inspect.iscoroutinefunction(func)
+        self._sampling = sample_every != 1 or sample_rate != None
+        self._stats = sharded_stats()
+        self._local = self._stats._local
+        functools.update_wrapper(self, func)
+        self.qualname = getattr(func, '__qualname__', self.name)
+        registry.register(self.qualname, self)
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self._key = f'_timer_{name}'
 
     def __call__(self, *args, **kwargs):
-        start = time.time()
-        result = self.func(*args, **kwargs)
-        elapsed = time.time() - start
+        return self._timed(None, *args, **kwargs)
 
-        # Update stats incrementally
-        self.counter += 1
-        self.total_time += elapsed
-        self.total_squared_time += elapsed ** 2
-        self.min_time = min(self.min_time, elapsed)
-        self.max_time = max(self.max_time, elapsed)
+    def _timed(self, instance_stats, *args, **kwargs):
+        # sampling decision first, a call that is not timed only increments
+        # the call counter of its thread
+        try:
+            local = self._local.stats
+        except AttributeError:
+            local = self._stats.local()
+        local.calls += 1
+        if self._sampling and ((local.calls - 1) % self.sample_every != 0
+                               or (self.sample_rate != None and random.random() >= self.sample_rate)):
+            return self.func(*args, **kwargs)
+        if not _enabled:
+            return self.func(*args, **kwargs)
+        if instance_stats is not None:
+            instance_stats = instance_stats.local()
+            instance_stats.calls += 1
+
+        if self._is_async:
+            return self._timed_async(local, instance_stats, args, kwargs)
+        if not registry.active:
+            start = time.perf_counter_ns()
+            result = self.func(*args, **kwargs)
+            self._record(local, instance_stats, time.perf_counter_ns() - start)
+            return result
+        parent, span = registry.enter(self.qualname)
+        start = time.perf_counter_ns()
+        try:
+            result = self.func(*args, **kwargs)
+        finally:
+            registry.leave(parent)
+        elapsed = time.perf_counter_ns() - start
+        self._record(local, instance_stats, elapsed)
+        registry.record(span, start, elapsed)
+        return result
 
+    async def _timed_async(self, local, instance_stats, args, kwargs):
+        span = registry.child(self.qualname) if registry.active else None
+        start = time.perf_counter_ns()
+        result = await self.func(*args, **kwargs)
+        elapsed = time.perf_counter_ns() - start
+        self._record(local, instance_stats, elapsed)
+        if span is not None:
+            registry.record(span, start, elapsed)
         return result
+
+    def _record(self, local, instance_stats, elapsed):
+        local.record(elapsed)
+        if instance_stats is not None:
+            instance_stats.record(elapsed)
+
+    def stats(self):
+        """
+        Snapshot of the statistics of all threads, as one timer_stats.
+        """
+        return self._stats.merged()
+
+    def reset(self):
+        self._stats.reset()
+
+    @property
+    def calls(self):
+        return self.stats().calls
+
+    @property
+    def counter(self):
+        return self.stats().counter
+
+    @property
+    def estimated_total_time(self):
+        return self.stats().estimated_total_time
+
+    def total_time_interval(self, confidence=0.95):
+        return self.stats().total_time_interval(confidence)
+
+    @property
+    def total_time(self):
+        return self.stats().total_time
+
+    @property
+    def mean_time(self):
+        return self.stats().mean_time
+
+    @property
+    def std_time(self):
+        return self.stats().std_time
+
+    @property
+    def min_time(self):
+        return self.stats().min_time
+
+    @property
+    def max_time(self):
+        return self.stats().max_time
+
+    @property
+    def histogram(self):
+        return self.stats().histogram
+
+    def percentile(self, p):
+        """
+        p-th percentile of the execution time in seconds, e.g. percentile(99).
+        """
+        return self.stats().percentile(p)
     
     def __get__(self, instance, owner):
         """
         Descriptor logic so the decorator works on methods.
         - Access via class: return the decorator itself (to access print_stats).
-        - Access via instance: return a bound proxy that calls through __call__
-          and forwards attributes like print_stats.
+        - Access via instance: return the bound_timer of the instance, which
+          calls through the decorator and forwards attributes like print_stats.
+          It is cached in the instance __dict__, so it is created once per
+          instance and a later access is one dictionary lookup.
         """
         if instance is None:
             # Accessed as IsingSimulation.simulate → we want the decorator itself
             return self
 
-        # Accessed as sim1.simulate → return a bound proxy
-        decorator = self
-
-        class BoundTimer:
-            def __init__(self, inst):
-                self._instance = inst
+        # Accessed as sim1.simulate → return the bound proxy of sim1
+        try:
+            attributes = instance.__dict__
+        except AttributeError:
+            # instances without __dict__ get a new proxy every time
+            return bound_timer(self, instance)
+        proxy = attributes.get(self._key)
+        if proxy is None:
+            proxy = bound_timer(self, instance)
+            # setdefault, so threads racing on the first access share one proxy
+            cached = attributes.setdefault(self._key, proxy)
+            if cached is None:
+                # left by a copy or pickle of the instance
+                attributes[self._key] = proxy
+            else:
+                proxy = cached
+        return proxy
 
-            def __call__(self, *args, **kwargs):
-                # Call the decorator's __call__, inserting the instance as first arg
-                return decorator(self._instance, *args, **kwargs)
-
-            def __getattr__(self, name):
-                # Forward attributes (like print_stats, counter, etc.)
-                return getattr(decorator, name)
-
-        return BoundTimer(instance)
     def print_stats(self):
-        if self.counter == 0:
-            print("No runs yet.")
-            return
-
-        avg = self.total_time / self.counter
-        variance = (self.total_squared_time / self.counter) - (avg ** 2)
-        std = np.sqrt(variance) if variance > 0 else 0.0
-
-        print(f"runs: {self.counter}")
-        print(f"average (s): {avg:.6f}")
-        print(f"std (s): {std:.6f}")
-        print(f"min (s): {self.min_time:.6f}")
-        print(f"max (s): {self.max_time:.6f}")
\ No newline at end of file
+        self.stats().print_stats()
@@ -1,10 +1,16 @@
 import numpy as np
-from PIL import Image, ImageDraw
 from scipy import signal
 from decorator01 import TimerDecorator
+from ising_render import render_frame, spin_indices
+from ising_animation import open_animation
+from ising_recorder import observable_recorder
+from ising_checkpoint import save_checkpoint
+from ising_analysis import adaptive_sampling
+from boltzmann import boltzmann_acceptance, table_index
+from ising_rng import new_seed, make_generator, sweep_randoms
 
 
-class ising_simulation:
+class ising_simulation(boltzmann_acceptance):
     """
     Class for simulating 2D Ising model using Metropolis algorithm.
 
@@ -16,16 +22,36 @@ class ising_simulation:
         bigsteps (int): Number of big steps (each consisting of multiple small steps).
         ups_density (float): Initial density of up spins (+1).
         img_filename (str): Filename to save the final spin configuration image.
-        animation_filename (str): Filename to save the animation of the simulation.
-        magnetisation_filename (str): Filename to save the magnetization data.
+        animation_filename (str): Filename to save the animation of the simulation, a '.gif' file is
+            written frame by frame, any other name is a directory of compressed frame chunks.
+        animation_stride (int): Only every animation_stride-th drawn step is added to the animation.
+        magnetisation_filename (str): Directory for the recorded observables, one .npy file per
+            column (see ising_recorder, export_text gives the old text format).
+        step (int): Number of big steps done by the current simulate() run, restored by ising_checkpoint.resume.
+        acceptance (float): Flipped spins per lattice site in the last big step (above 1 is possible for cluster engines).
+        engine (str): Sweep engine used by big_step, 'random' (N*N random-site Metropolis updates) or
+            'wolff' / 'swendsen_wang' (compiled cluster updates from ising_cluster, needs numba).
+        seed (int): Seed of the simulation, a fresh one is drawn and stored when None.
+        stream_id (int): Stream of the seed used by this simulation, give parallel runs different ids.
+        rng (np.random.Generator): Generator of the stream (ising_rng.make_generator).
+        hamiltionian (float): Running total of the energy, updated by every accepted flip.
+        total_spin (int): Running sum of all spins, updated by every accepted flip.
 
     Methods:
-        show_array(): Displays the current spin configuration as an image.
+        draw_array(number, show=False, mode='P'): Renders the spin configuration with ising_render, in palette or RGB mode.
+        close_animation(): Finishes the animation file written by draw_array.
+        save_M(step, create_file=False): Records step, magnetisation, energy and acceptance rate.
+        close_recorder(): Flushes and closes the observable recorder used by save_M.
         calculate_hamiltionian(): Calculates and prints the Hamiltonian of the current configuration.
+        recalculate_observables(): Recomputes the running energy and magnetisation totals from the lattice.
+        acceptance_table(): Returns Metropolis acceptance probabilities, rebuilt when j, beta or force_B change.
         small_step(): Performs a single Metropolis update on a randomly chosen spin.
-        big_step(): Performs a full sweep of Metropolis updates over the entire lattice.
-        simulate(): Runs the simulation for the specified number of big steps.
-        calculate_M(): Calculates and returns the magnetization of the current configuration.
+        big_step(engine=None): Performs a full sweep of Metropolis or cluster updates over the entire lattice.
+        simulate(checkpoint_dir=None, checkpoint_every=100): Runs the simulation for the specified number
+            of big steps, saving a checkpoint every checkpoint_every steps if checkpoint_dir is given.
+        simulate_adaptive(target_error, observable='abs_M', check_every=100, max_steps=None): Runs until
+            the equilibrium mean of the observable is known to target_error, see ising_analysis.adaptive_sampling.
+        calculate_M(): Returns the magnetization of the current configuration from the running total.
     """
     def __init__(self, 
                  arr_size, 
@@ -36,7 +62,11 @@ class ising_simulation:
                  ups_density = 0.5, 
                  img_filename = None,
                  animation_filename = None,
-                 magnetisation_filename = None):
+                 magnetisation_filename = None,
+                 animation_stride = 1,
+                 engine = 'random',
+                 seed = None,
+                 stream_id = 0):
         self.j = j
         self.beta = beta
         self.force_B = force_B
@@ -44,132 +74,172 @@ class ising_simulation:
         self.ups_density = ups_density
         self.img_filename = img_filename
         self.animation_filename = animation_filename
-        if animation_filename != None:
-            self.animation_frames = []
+        self.animation_stride = animation_stride
+        self.animation_sink = None
         self.magnetisation_filename = magnetisation_filename
         self.hamiltionian = 0
+        self.acceptance = 0.0
+        self.step = 0
+        self.accepted = 0
+        self.recorder = None
+        self.engine = engine
+        if seed == None:
+            seed = new_seed()
+        self.seed = int(seed)
+        self.stream_id = stream_id
+        self.rng = make_generator(self.seed, self.stream_id)
+        self._table = None
+        self._table_key = None
         self.neighborhood_kernel = np.array([[0, 1, 0],
                                                 [1, 0, 1],
                                                 [0, 1, 0]])
 
         self.M = (-1)*np.ones([arr_size, arr_size], dtype=np.int8)
         amount_of_ups = int(self.ups_density * self.M.size)
-        idxes = np.random.choice(self.M.size, amount_of_ups, replace=False)
+        idxes = self.rng.choice(self.M.size, amount_of_ups, replace=False)
         self.M.flat[idxes] = 1
+        self.randoms = sweep_randoms(self.rng, arr_size)
+        self.recalculate_observables()
 
 
-    def draw_array(self, number, show=False):
-        image_size = 1000
-        image = Image.new('RGB', (image_size, image_size), 'black')
-        draw = ImageDraw.Draw(image)
-
-        red_color = '#f0827a'
-        blue_color = '#7ab3f0'
+    @TimerDecorator
+    def draw_array(self, number, show=False, mode='P'):
+        if show == True or self.img_filename != None:
+            image = render_frame(self.M, mode)
 
-        matrix_width = self.M.shape[0]
-        dw = np.floor(image_size/matrix_width)
-        color = 'white'
-        for x in range(matrix_width):
-            for y in range(matrix_width):
-                if self.M[x,y] == 1:
-                    color = red_color
-                else:
-                    color = blue_color
+            if show == True:
+                image.show()
 
-                draw.rectangle([x*dw, y*dw, (x+1)*dw, (y+1)*dw], fill=color)
+            if self.img_filename != None:
+                image.save(f'{self.img_filename}{number:04d}.png')
 
-        if show == True:
-            image.show()
+        if self.animation_filename != None and number % self.animation_stride == 0:
+            if self.animation_sink == None:
+                self.animation_sink = open_animation(self.animation_filename)
+            self.animation_sink.add_frame(spin_indices(self.M))
 
-        if self.img_filename != None:
-            image.save(f'{self.img_filename}{number:04d}.png')
 
-        if self.animation_filename != None:
-            self.animation_frames.append(image)
+    def close_animation(self):
+        if self.animation_sink != None:
+            self.animation_sink.close()
+            self.animation_sink = None
 
 
-    def calculate_hamiltionian(self):
+    def recalculate_observables(self):
+        # full O(N^2) pass, the sweeps keep both totals up to date afterwards
+        self.total_spin = int(self.M.sum())
         self.hamiltionian = (-1) * 1/2 * self.j * (  \
-                self.M * signal.convolve2d(self.M, self.neighborhood_kernel, mode = 'same') \
+                self.M * signal.convolve2d(self.M, self.neighborhood_kernel, mode = 'same', boundary = 'wrap') \
                     ).sum() \
-            - self.force_B * self.M.sum()
+            - self.force_B * self.total_spin
+
+
+    def calculate_hamiltionian(self):
+        self.recalculate_observables()
         print(self.hamiltionian)
   
 
-    def small_step(self):
-        idx_x, idx_y = np.random.randint(0, self.M.shape[0], size=2)
-        s_i = self.M[idx_x, idx_y]
-        kh, kw = self.neighborhood_kernel.shape
-        assert kh % 2 == 1 and kw % 2 == 1, "Kernel must have odd shape."
-        ph, pw = kh // 2, kw // 2
-
-        # pad and extract the patch centered at (idx_x, j)
-        Mp = np.pad(self.M, ((ph, ph), (pw, pw)), mode='constant')
-        patch = Mp[idx_x:idx_x+kh, idx_y:idx_y+kw]  # because Mp is shifted by padding
-        
-        E_0 = (-1) * 1/2 * self.j * (  \
-                s_i * signal.convolve2d(patch, self.neighborhood_kernel, mode = 'same') \
-                    ).sum() \
-            - self.force_B * patch.sum()
+    def _update(self, idx_x, idx_y, u, table):
+        # Python ints, int8 arithmetic would wrap in self.j * neighbours for j >= 32
+        s_i = int(self.M[idx_x, idx_y])
 
-        E_1 = (-1) * 1/2 * self.j * (  \
-                (-1) * s_i * signal.convolve2d(patch, self.neighborhood_kernel, mode = 'same') \
-                    ).sum() \
-            - self.force_B * patch.sum()
-        
-        delta_E = E_1 - E_0
-        if delta_E < 0:
+        # periodic boundary conditions
+        N = self.M.shape[0]
+        neighbours = int(self.M[(idx_x - 1) % N, idx_y]) + int(self.M[(idx_x + 1) % N, idx_y]) \
+                   + int(self.M[idx_x, (idx_y - 1) % N]) + int(self.M[idx_x, (idx_y + 1) % N])
+
+        prob = table[table_index(s_i, neighbours)]
+        if prob >= 1.0 or u < prob:
             self.M[idx_x, idx_y] *= (-1)
-        else:
-            prob = np.exp( (-1) * self.beta * delta_E )
-            if np.random.rand() < prob:
-                self.M[idx_x, idx_y] *= (-1)
+            self.accepted += 1
+            self.hamiltionian += 2 * s_i * (self.j * neighbours + self.force_B)
+            self.total_spin -= 2 * s_i
 
 
-    def big_step(self):
-        for _ in range(self.M.size):
-            self.small_step()
+    def small_step(self):
+        idx_x, idx_y = self.rng.integers(0, self.M.shape[0], size=2)
+        self._update(idx_x, idx_y, self.rng.random(), self.acceptance_table())
+
+
+    @TimerDecorator
+    def big_step(self, engine=None):
+        if engine == None:
+            engine = self.engine
+
+        if engine == 'random':
+            self.accepted = 0
+            table = self.acceptance_table()
+            # random numbers of the whole sweep are drawn at once
+            idx_x, idx_y, uniforms = self.randoms.draw()
+            for x, y, u in zip(idx_x.tolist(), idx_y.tolist(), uniforms.tolist()):
+                self._update(x, y, u, table)
+            self.acceptance = self.accepted / self.M.size
+        elif engine == 'wolff' or engine == 'swendsen_wang':
+            # imported here, so the Metropolis path keeps working without numba
+            from ising_cluster import cluster_sweep
+            seed = np.uint64(self.rng.integers(0, 2**63 - 1))
+            delta_E, delta_M, flipped = cluster_sweep(engine, self.M, float(self.j), float(self.beta),
+                                             float(self.force_B), seed, np.uint64(0))
+            self.hamiltionian += delta_E
+            self.total_spin += int(delta_M)
+            self.acceptance = flipped / self.M.size
+        else:
+            raise ValueError(f"Unknown engine: {engine}")
 
 
     # Visualisation and output methods
     def calculate_M(self):
-        return 1/self.M.size * self.M.sum()
+        return 1/self.M.size * self.total_spin
     
 
     def save_M(self, step, create_file=False):
         if self.magnetisation_filename != None:
-            if create_file == True:
-                with open(self.magnetisation_filename, 'w') as f:
-                    f.write('Step\tMagnetisation\n')
+            if create_file == True or self.recorder == None:
+                self.close_recorder()
+                self.recorder = observable_recorder(self.magnetisation_filename)
+            self.recorder.record(step, self.calculate_M(), self.hamiltionian, self.acceptance)
+
 
-            with open(self.magnetisation_filename, 'a') as f:
-                f.write(f'{step}\t{self.calculate_M()}\n')
+    def close_recorder(self):
+        if self.recorder != None:
+            self.recorder.close()
+            self.recorder = None
 
 
     # Main simulation method
-    def simulate_save(self):
-        i = 0
-        self.draw_array(i)
-        self.save_M(i, True)
-        i += 1
-        for _ in range(self.bigsteps):
-            self.big_step()
-            self.draw_array(i)
-            self.save_M(i)
-            i += 1
-
-        if self.animation_filename != None:
-            self.animation_frames[0].save(self.animation_filename,
-                                          save_all=True,
-                                          append_images=self.animation_frames[1:],
-                                          duration=200)
+    @TimerDecorator
+    def simulate_save(self, checkpoint_dir=None, checkpoint_every=100):
+        try:
+            if self.step == 0:
+                self.draw_array(0)
+                self.save_M(0, True)
+            while self.step < self.bigsteps:
+                self.big_step()
+                self.step += 1
+                self.draw_array(self.step)
+                self.save_M(self.step)
+                if checkpoint_dir != None and self.step % checkpoint_every == 0:
+                    save_checkpoint(self, checkpoint_dir)
+        finally:
+            self.close_animation()
+            self.close_recorder()
+        self.step = 0
     
 
     @TimerDecorator
-    def simulate(self):
-        i = 0
-        i += 1
-        for _ in range(self.bigsteps):
+    def simulate(self, checkpoint_dir=None, checkpoint_every=100):
+        while self.step < self.bigsteps:
             self.big_step()
-            i += 1
+            self.step += 1
+            if checkpoint_dir != None and self.step % checkpoint_every == 0:
+                save_checkpoint(self, checkpoint_dir)
+        self.step = 0
+
+
+    @TimerDecorator
+    def simulate_adaptive(self, target_error, observable='abs_M', check_every=100, max_steps=None):
+        try:
+            return adaptive_sampling(self, target_error, observable, check_every, max_steps)
+        finally:
+            self.close_recorder()
 
@@ -0,0 +1,160 @@
+import numpy as np
+
+
+def autocorrelation(series):
+    """
+    Normalised autocorrelation function of a time series, computed with FFT.
+
+    Returns:
+        np.ndarray: rho(t) for t = 0 .. len(series) - 1, with rho(0) = 1.
+    """
+    x = np.asarray(series, dtype=np.float64)
+    x = x - x.mean()
+    n = x.size
+    size = 1 << (2 * n - 1).bit_length()
+    f = np.fft.rfft(x, size)
+    acf = np.fft.irfft(f * np.conjugate(f), size)[:n]
+    if acf[0] == 0:
+        return np.ones(n)
+    return acf / acf[0]
+
+
+def integrated_autocorrelation_time(series, c = 5.0):
+    """
+    Integrated autocorrelation time with Sokal's automatic windowing.
+
+    tau_int = 1 + 2 * sum_{t=1}^{W} rho(t), where W is the smallest window with
+    W >= c * tau_int(W). With this convention uncorrelated data gives tau_int = 1
+    and the number of independent samples is len(series) / tau_int.
+
+    Args:
+        series (array_like): Observable recorded once per sweep.
+        c (float): Window constant, 5 is usual for exponential-like decay.
+
+    Returns:
+        tuple: (tau_int, W), tau_int in units of the sampling interval.
+    """
+    rho = autocorrelation(series)
+    taus = 1 + 2 * np.cumsum(rho[1:])
+    for window in range(1, taus.size + 1):
+        if window >= c * taus[window - 1]:
+            return taus[window - 1], window
+    return taus[-1], taus.size
+
+
+def mser_truncation(series, batch_size = 5):
+    """
+    Start of the equilibrated part of a series by the MSER-m rule.
+
+    The series is averaged in batches of batch_size and for every truncation
+    point d the statistic var(batches[d:]) / (n - d) is computed; its minimum
+    balances the bias of the discarded transient against the loss of data.
+    Only truncation points in the first half are considered, a minimum at the
+    last of them means the series has not equilibrated yet.
+
+    Returns:
+        tuple: (d, equilibrated), d in samples of the original series.
+    """
+    x = np.asarray(series, dtype=np.float64)
+    n = x.size // batch_size
+    if n < 4:
+        return 0, False
+    batches = x[:n * batch_size].reshape(n, batch_size).mean(axis=1)
+
+    # mean and variance of every tail batches[d:] from reversed cumulative sums
+    tail_n = np.arange(n, 0, -1)
+    tail_sum = np.cumsum(batches[::-1])[::-1]
+    tail_sq = np.cumsum(batches[::-1]**2)[::-1]
+    tail_var = tail_sq / tail_n - (tail_sum / tail_n)**2
+
+    half = n // 2
+    statistic = tail_var[:half] / tail_n[:half]
+    d = int(np.argmin(statistic))
+    return d * batch_size, d < half - 1
+
+
+def blocking_error(series, min_blocks = 32):
+    """
+    Standard error of the mean of a correlated series by Flyvbjerg-Petersen blocking.
+
+    Neighbouring samples are averaged pairwise until the naive error estimate
+    stops growing: the first level whose estimate agrees with the next one
+    within its own uncertainty, sqrt(2 / (n - 1)) relative, is the plateau.
+    Levels with fewer than min_blocks blocks are too noisy to be used.
+
+    Returns:
+        tuple: (error, converged), without a plateau the error of the last
+            usable level is returned, a lower bound of the true error.
+    """
+    x = np.asarray(series, dtype=np.float64)
+    errors = []
+    while x.size >= min_blocks:
+        errors.append((np.sqrt(x.var(ddof=1) / x.size), x.size))
+        x = 0.5 * (x[:x.size // 2 * 2:2] + x[1:x.size // 2 * 2:2])
+    if len(errors) == 0:
+        return np.inf, False
+
+    for (error, n), (next_error, _) in zip(errors, errors[1:]):
+        if next_error - error <= error * np.sqrt(2 / (n - 1)):
+            return max(error, next_error), True
+    return errors[-1][0], False
+
+
+def adaptive_sampling(sim,
+                      target_error,
+                      observable = 'abs_M',
+                      check_every = 100,
+                      max_steps = None,
+                      batch_size = 5,
+                      min_blocks = 32):
+    """
+    Runs big steps of a simulation until an observable is known to target_error.
+
+    Every check_every sweeps the recorded series is checked with MSER for the
+    end of the equilibration transient, the remaining samples are analysed with
+    blocking. The run stops as soon as the blocking error has converged and is
+    at most target_error, or after max_steps sweeps. Steps are recorded with
+    sim.save_M as in simulate().
+
+    Args:
+        sim: ising_simulation or ising_simulation_numba.
+        target_error (float): Wanted standard error of the mean of the observable.
+        observable (str): 'M', 'abs_M' or 'E' (energy per spin).
+        check_every (int): Sweeps between two analyses.
+        max_steps (int): Upper limit of sweeps, sim.bigsteps by default.
+
+    Returns:
+        dict: steps (sweeps done), equilibration (sweeps discarded), mean,
+            error, tau_int of the equilibrated part and converged (target met).
+    """
+    measures = {'M': lambda: sim.calculate_M(),
+                'abs_M': lambda: abs(sim.calculate_M()),
+                'E': lambda: sim.hamiltionian / sim.M.size}
+    if observable not in measures:
+        raise ValueError(f"Unknown observable: {observable}")
+    measure = measures[observable]
+    if max_steps == None:
+        max_steps = sim.bigsteps
+
+    series = np.empty(max_steps)
+    result = {'steps': 0, 'equilibration': None, 'mean': np.nan,
+              'error': np.inf, 'tau_int': np.nan, 'converged': False}
+    for step in range(max_steps):
+        sim.big_step()
+        sim.save_M(step + 1)
+        series[step] = measure()
+
+        if (step + 1) % check_every != 0 and step + 1 != max_steps:
+            continue
+        result['steps'] = step + 1
+        d, equilibrated = mser_truncation(series[:step + 1], batch_size)
+        if not equilibrated:
+            continue
+        samples = series[d:step + 1]
+        error, converged = blocking_error(samples, min_blocks)
+        result.update(equilibration=d, mean=samples.mean(), error=error,
+                      tau_int=integrated_autocorrelation_time(samples)[0])
+        if converged and error <= target_error:
+            result['converged'] = True
+            break
+    return result
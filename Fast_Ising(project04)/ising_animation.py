@@ -0,0 +1,161 @@
+import os
+import glob
+import numpy as np
+from PIL import GifImagePlugin
+from ising_render import IMAGE_SIZE, upscale, to_image
+
+
+class gif_stream_writer:
+    """
+    Writes an animated GIF frame by frame, without keeping earlier frames in memory.
+
+    Every frame is encoded and flushed to the file as soon as it is added, so a
+    crashed run still leaves all frames written so far (only the GIF trailer is
+    missing, which most viewers accept).
+
+    Attributes:
+        filename (str): Path of the GIF file.
+        duration (int): Display time of every frame in milliseconds.
+        image_size (int): Width and height of the frames in pixels.
+        frames (int): Number of frames written so far.
+
+    Methods:
+        add_frame(indices): Encodes a frame of palette indices (from ising_render.spin_indices).
+        checkpoint(): Flushes the file and returns its size, to reopen it later with offset.
+        close(): Writes the GIF trailer and closes the file.
+    """
+    def __init__(self, filename, duration=200, image_size=IMAGE_SIZE, loop=0, offset=None):
+        """
+        With offset=None a new file is created, otherwise an existing one is
+        truncated to `offset` bytes (a value from checkpoint()) and continued.
+        """
+        self.filename = filename
+        self.duration = duration
+        self.image_size = image_size
+        self.loop = loop
+        if offset == None:
+            self.frames = 0
+            self._file = open(filename, 'wb')
+        else:
+            self.frames = 1 if offset > 0 else 0
+            self._file = open(filename, 'rb+')
+            self._file.truncate(offset)
+            self._file.seek(offset)
+
+
+    def add_frame(self, indices):
+        image = to_image(upscale(indices, self.image_size))
+        if self.frames == 0:
+            header, _ = GifImagePlugin.getheader(image, info={'loop': self.loop})
+            for chunk in header:
+                self._file.write(chunk)
+        for chunk in GifImagePlugin.getdata(image, duration=self.duration):
+            self._file.write(chunk)
+        self._file.flush()
+        self.frames += 1
+
+
+    def checkpoint(self):
+        self._file.flush()
+        return self._file.tell()
+
+
+    def close(self):
+        if not self._file.closed:
+            self._file.write(b';')
+            self._file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class chunk_stream_writer:
+    """
+    Stores frames of palette indices in compressed .npz chunks of a directory.
+
+    Only chunk_size frames at lattice resolution are held in memory. The chunks
+    can be turned into a GIF later with assemble_gif().
+
+    Attributes:
+        directory (str): Directory of the chunk files, created if needed.
+        chunk_size (int): Number of frames per chunk file.
+        frames (int): Number of frames added so far.
+
+    Methods:
+        add_frame(indices): Buffers a frame and writes a chunk when the buffer is full.
+        checkpoint(): Writes the buffered frames and returns the number of chunks, to reopen later with offset.
+        close(): Writes the last, possibly shorter, chunk.
+    """
+    def __init__(self, directory, chunk_size=100, offset=None):
+        """
+        With offset given, chunks from number `offset` on (written after the
+        checkpoint() that returned it) are removed and writing continues there.
+        """
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.frames = 0
+        self._chunk = 0 if offset == None else offset
+        self._buffer = []
+        os.makedirs(directory, exist_ok=True)
+        for chunk in glob.glob(os.path.join(directory, 'frames_*.npz')):
+            if int(os.path.basename(chunk)[7:12]) >= self._chunk:
+                os.remove(chunk)
+
+
+    def add_frame(self, indices):
+        self._buffer.append(indices)
+        self.frames += 1
+        if len(self._buffer) == self.chunk_size:
+            self._flush()
+
+
+    def _flush(self):
+        if self._buffer:
+            np.savez_compressed(os.path.join(self.directory, f'frames_{self._chunk:05d}.npz'),
+                                frames=np.stack(self._buffer))
+            self._chunk += 1
+            self._buffer = []
+
+
+    def checkpoint(self):
+        self._flush()
+        return self._chunk
+
+
+    def close(self):
+        self._flush()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def assemble_gif(directory, filename, duration=200, image_size=IMAGE_SIZE):
+    """
+    Builds an animated GIF from the chunks written by chunk_stream_writer, one chunk in memory at a time.
+    """
+    with gif_stream_writer(filename, duration, image_size) as writer:
+        for chunk in sorted(glob.glob(os.path.join(directory, 'frames_*.npz'))):
+            with np.load(chunk) as data:
+                for indices in data['frames']:
+                    writer.add_frame(indices)
+
+
+def open_animation(filename, duration=200, image_size=IMAGE_SIZE, offset=None):
+    """
+    Opens the animation sink for `filename`: a streamed GIF for '.gif' files,
+    otherwise a directory of compressed frame chunks. `offset` is a value from
+    the sink's checkpoint() to continue an interrupted animation.
+    """
+    if filename.lower().endswith('.gif'):
+        return gif_stream_writer(filename, duration, image_size, offset=offset)
+    return chunk_stream_writer(filename, offset=offset)
@@ -0,0 +1,111 @@
+import os
+import json
+import inspect
+import numpy as np
+from numpy.lib.format import open_memmap
+from ising_rng import generator_state, set_generator_state, sweep_randoms
+
+
+# constructor argument -> attribute holding its value
+CONSTRUCTOR_ATTRIBUTES = {'j': 'j',
+                          'beta': 'beta',
+                          'force_B': 'force_B',
+                          'amount_of_steps': 'bigsteps',
+                          'ups_density': 'ups_density',
+                          'img_filename': 'img_filename',
+                          'animation_filename': 'animation_filename',
+                          'magnetisation_filename': 'magnetisation_filename',
+                          'animation_stride': 'animation_stride',
+                          'engine': 'engine',
+                          'seed': 'seed',
+                          'stream_id': 'stream_id'}
+
+
+def _plain(value):
+    # NumPy scalars (e.g. a beta taken from np.linspace) are not JSON serialisable
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _simulation_classes():
+    # imported here, the simulation modules import this one
+    from ising import ising_simulation
+    from ising_numba import ising_simulation_numba
+    return {'ising_simulation': ising_simulation,
+            'ising_simulation_numba': ising_simulation_numba}
+
+
+def save_checkpoint(sim, directory):
+    """
+    Saves everything needed to continue a simulation bit for bit.
+
+    The lattice is written through a memory map into lattice.npy, the rest of
+    the state (parameters, step and sweep counters, running observables, state
+    of the simulation's random generator, recorder and animation positions)
+    goes to state.json.
+    Both files are first written under temporary names and then renamed, so an
+    interrupted checkpoint leaves the previous one intact.
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    lattice = open_memmap(os.path.join(directory, 'lattice.tmp.npy'), mode='w+',
+                          dtype=sim.M.dtype, shape=sim.M.shape)
+    lattice[:] = sim.M
+    lattice.flush()
+    del lattice
+
+    parameters = inspect.signature(type(sim).__init__).parameters
+    state = {'class': type(sim).__name__,
+             'arr_size': sim.M.shape[0],
+             'arguments': {name: _plain(getattr(sim, attribute))
+                           for name, attribute in CONSTRUCTOR_ATTRIBUTES.items()
+                           if name in parameters},
+             'step': sim.step,
+             'sweep': getattr(sim, 'sweep', 0),
+             'hamiltionian': float(sim.hamiltionian),
+             'total_spin': int(sim.total_spin),
+             'acceptance': float(sim.acceptance),
+             'rng': generator_state(sim.rng),
+             'recorder_rows': None if sim.recorder == None else sim.recorder.checkpoint(),
+             'animation_offset': None if sim.animation_sink == None else sim.animation_sink.checkpoint()}
+
+    with open(os.path.join(directory, 'state.tmp.json'), 'w') as f:
+        json.dump(state, f)
+    os.replace(os.path.join(directory, 'lattice.tmp.npy'), os.path.join(directory, 'lattice.npy'))
+    os.replace(os.path.join(directory, 'state.tmp.json'), os.path.join(directory, 'state.json'))
+
+
+def resume(directory):
+    """
+    Rebuilds the simulation saved by save_checkpoint in `directory`.
+
+    The lattice is memory-mapped copy-on-write, so a large lattice is paged in
+    as the sweeps touch it instead of being copied up front, and the checkpoint
+    file itself is never modified. Calling simulate() / simulate_save() on the
+    returned object continues from the saved step.
+    """
+    from ising_recorder import observable_recorder
+    from ising_animation import open_animation
+
+    with open(os.path.join(directory, 'state.json')) as f:
+        state = json.load(f)
+
+    cls = _simulation_classes()[state['class']]
+    sim = cls(arr_size=1, **state['arguments'])
+    sim.M = np.asarray(np.load(os.path.join(directory, 'lattice.npy'), mmap_mode='c'))
+    sim.step = state['step']
+    if hasattr(sim, 'sweep'):
+        sim.sweep = state['sweep']
+    sim.hamiltionian = state['hamiltionian']
+    sim.total_spin = state['total_spin']
+    sim.acceptance = state['acceptance']
+    sim.acceptance_table()  # caches the table for the current j, beta and force_B
+
+    set_generator_state(sim.rng, state['rng'])
+    if hasattr(sim, 'randoms'):
+        sim.randoms = sweep_randoms(sim.rng, sim.M.shape[0])
+
+    if state['recorder_rows'] != None:
+        sim.recorder = observable_recorder(sim.magnetisation_filename, offset=state['recorder_rows'])
+    if state['animation_offset'] != None:
+        sim.animation_sink = open_animation(sim.animation_filename, offset=state['animation_offset'])
+    return sim
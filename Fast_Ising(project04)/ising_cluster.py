@@ -0,0 +1,207 @@
+import numpy as np
+from numba import njit
+from ising_rng import rng_stream, rng_next
+
+
+# Both cluster engines treat the external field as a bond to a fixed ghost spin
+# pointing along force_B: a spin aligned with the field joins the ghost with
+# probability 1 - exp(-2 * beta * |force_B|), and clusters attached to the ghost
+# are never flipped. Energy changes are accumulated flip by flip, so the sum
+# is exact whatever order the cluster is flipped in.
+@njit
+def _flip(M, idx_x, idx_y, j, force_B):
+    N = M.shape[0]
+    s_i = M[idx_x, idx_y]
+    neighbours = M[(idx_x - 1) % N, idx_y] + M[(idx_x + 1) % N, idx_y] \
+               + M[idx_x, (idx_y - 1) % N] + M[idx_x, (idx_y + 1) % N]
+    M[idx_x, idx_y] = -s_i
+    return 2 * s_i * (j * neighbours + force_B), -2 * s_i
+
+
+@njit
+def wolff_sweep(M, j, beta, force_B, seed, sweep):
+    """
+    Wolff single-cluster updates until at least N*N spins were visited.
+
+    Returns the change of energy, the change of the spin sum, the number of
+    flipped spins and the number of clusters built.
+    """
+    N = M.shape[0]
+    state = rng_stream(seed, sweep, np.uint64(0))
+    p_bond = 1.0 - np.exp(-2.0 * beta * j)
+    p_ghost = 1.0 - np.exp(-2.0 * beta * abs(force_B))
+    field_sign = 1 if force_B > 0 else -1
+
+    label = np.zeros((N, N), dtype=np.int64)
+    cluster = np.empty((N * N, 2), dtype=np.int64)
+    delta_E = 0.0
+    delta_M = 0
+    flipped = 0
+    visited = 0
+    clusters = 0
+
+    while visited < N * N:
+        clusters += 1
+        state, r = rng_next(state)
+        idx_x = int(r * N)
+        state, r = rng_next(state)
+        idx_y = int(r * N)
+        s = M[idx_x, idx_y]
+        ghost = force_B != 0 and s == field_sign
+
+        label[idx_x, idx_y] = clusters
+        cluster[0, 0] = idx_x
+        cluster[0, 1] = idx_y
+        size = 1
+        head = 0
+        attached = False
+
+        while head < size:
+            x = cluster[head, 0]
+            y = cluster[head, 1]
+            head += 1
+            if ghost:
+                state, r = rng_next(state)
+                if r < p_ghost:
+                    attached = True
+                    break
+
+            for k in range(4):
+                if k == 0:
+                    nx, ny = (x - 1) % N, y
+                elif k == 1:
+                    nx, ny = (x + 1) % N, y
+                elif k == 2:
+                    nx, ny = x, (y - 1) % N
+                else:
+                    nx, ny = x, (y + 1) % N
+                if M[nx, ny] == s and label[nx, ny] != clusters:
+                    state, r = rng_next(state)
+                    if r < p_bond:
+                        label[nx, ny] = clusters
+                        cluster[size, 0] = nx
+                        cluster[size, 1] = ny
+                        size += 1
+
+        visited += size
+        if not attached:
+            for k in range(size):
+                dE, dM = _flip(M, cluster[k, 0], cluster[k, 1], j, force_B)
+                delta_E += dE
+                delta_M += dM
+            flipped += size
+
+    return delta_E, delta_M, flipped, clusters
+
+
+@njit
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+@njit
+def _union(parent, a, b):
+    root_a = _find(parent, a)
+    root_b = _find(parent, b)
+    if root_a != root_b:
+        parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+@njit
+def swendsen_wang_sweep(M, j, beta, force_B, seed, sweep):
+    """
+    One Swendsen-Wang update: every cluster of the lattice is flipped with
+    probability 1/2, except the clusters attached to the ghost spin.
+
+    Returns the change of energy, the change of the spin sum, the number of
+    flipped spins and the number of clusters.
+    """
+    N = M.shape[0]
+    state = rng_stream(seed, sweep, np.uint64(0))
+    p_bond = 1.0 - np.exp(-2.0 * beta * j)
+    p_ghost = 1.0 - np.exp(-2.0 * beta * abs(force_B))
+    field_sign = 1 if force_B > 0 else -1
+
+    parent = np.arange(N * N)
+    for idx_x in range(N):
+        for idx_y in range(N):
+            s = M[idx_x, idx_y]
+            if M[(idx_x + 1) % N, idx_y] == s:
+                state, r = rng_next(state)
+                if r < p_bond:
+                    _union(parent, idx_x * N + idx_y, ((idx_x + 1) % N) * N + idx_y)
+            if M[idx_x, (idx_y + 1) % N] == s:
+                state, r = rng_next(state)
+                if r < p_bond:
+                    _union(parent, idx_x * N + idx_y, idx_x * N + (idx_y + 1) % N)
+
+    # decision of every root: -1 undecided, 0 keep, 1 flip
+    decision = -np.ones(N * N, dtype=np.int8)
+    if force_B != 0:
+        for i in range(N * N):
+            if M[i // N, i % N] == field_sign:
+                state, r = rng_next(state)
+                if r < p_ghost:
+                    decision[_find(parent, i)] = 0
+
+    delta_E = 0.0
+    delta_M = 0
+    flipped = 0
+    clusters = 0
+    for i in range(N * N):
+        root = _find(parent, i)
+        if root == i:
+            clusters += 1
+        if decision[root] == -1:
+            state, r = rng_next(state)
+            decision[root] = 1 if r < 0.5 else 0
+        if decision[root] == 1:
+            dE, dM = _flip(M, i // N, i % N, j, force_B)
+            delta_E += dE
+            delta_M += dM
+            flipped += 1
+
+    return delta_E, delta_M, flipped, clusters
+
+
+def cluster_sweep(engine, M, j, beta, force_B, seed, sweep):
+    """
+    Runs one sweep of the 'wolff' or 'swendsen_wang' engine on M in place.
+
+    Returns:
+        tuple: Change of the energy, change of the spin sum and number of flipped spins.
+    """
+    if j <= 0:
+        raise ValueError("Cluster engines require a ferromagnetic coupling j > 0.")
+    if engine == 'wolff':
+        delta_E, delta_M, flipped, _ = wolff_sweep(M, j, beta, force_B, seed, sweep)
+    elif engine == 'swendsen_wang':
+        delta_E, delta_M, flipped, _ = swendsen_wang_sweep(M, j, beta, force_B, seed, sweep)
+    else:
+        raise ValueError(f"Unknown cluster engine: {engine}")
+    return delta_E, delta_M, flipped
+
+
+if __name__ == "__main__":
+    from ising_numba import ising_simulation_numba
+    from ising_analysis import integrated_autocorrelation_time
+
+    beta_c = np.log(1 + np.sqrt(2)) / 2
+    for engine in ['checkerboard', 'wolff', 'swendsen_wang']:
+        sim = ising_simulation_numba(arr_size=64,
+                                     j=1,
+                                     beta=beta_c,
+                                     force_B=0,
+                                     amount_of_steps=0,
+                                     engine=engine)
+        for _ in range(500):
+            sim.big_step()
+        series = np.empty(5000)
+        for i in range(series.size):
+            sim.big_step()
+            series[i] = abs(sim.calculate_M())
+        tau, window = integrated_autocorrelation_time(series)
+        print(f"{engine}: tau_int(|M|) = {tau:.2f} sweeps (window {window})")
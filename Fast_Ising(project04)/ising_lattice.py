@@ -0,0 +1,360 @@
+import numpy as np
+from numba import njit, prange
+from decorator01 import TimerDecorator
+from ising_recorder import observable_recorder
+from ising_analysis import adaptive_sampling
+from ising_rng import new_seed, make_generator, stream_seed, rng_stream, rng_next
+
+
+# Sites of one colour class are updated in blocks of this many sites, every
+# block draws from its own random stream and can run on any thread.
+BLOCK_SIZE = 256
+# Number of distinct energy changes whose acceptance probability a block remembers.
+CACHE_SIZE = 16
+
+
+class lattice_geometry:
+    """
+    Neighbour structure of an arbitrary Ising lattice in compressed sparse row form.
+
+    The neighbours of site i are indices[indptr[i]:indptr[i + 1]], coupled to it
+    with couplings[indptr[i]:indptr[i + 1]]. Sites are split into colour classes
+    without bonds inside a class, the sites of colour c are
+    order[color_ptr[c]:color_ptr[c + 1]].
+
+    Attributes:
+        shape (tuple): Shape of the spin array, e.g. (L, L) or (L, L, L).
+        indptr (np.ndarray): int64, length n_sites + 1.
+        indices (np.ndarray): int64 neighbour indices, each bond appears twice.
+        couplings (np.ndarray): float64 coupling J of every entry of indices.
+        colors (np.ndarray): Colour class of every site.
+        order (np.ndarray): Sites sorted by colour.
+        color_ptr (np.ndarray): Start of every colour class in order.
+        n_sites (int): Number of sites.
+        n_bonds (int): Number of bonds.
+    """
+    def __init__(self, shape, bond_i, bond_j, bond_J, colors):
+        self.shape = tuple(shape)
+        self.n_sites = int(np.prod(self.shape))
+        self.n_bonds = len(bond_i)
+
+        # every bond i-j is stored as i -> j and j -> i
+        rows = np.concatenate([bond_i, bond_j]).astype(np.int64)
+        cols = np.concatenate([bond_j, bond_i]).astype(np.int64)
+        values = np.concatenate([bond_J, bond_J]).astype(np.float64)
+        perm = np.argsort(rows, kind='stable')
+        self.indices = cols[perm]
+        self.couplings = values[perm]
+        self.indptr = np.zeros(self.n_sites + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=self.n_sites), out=self.indptr[1:])
+
+        self.colors = np.asarray(colors, dtype=np.int64).ravel()
+        if np.any(self.colors[rows] == self.colors[cols]):
+            raise ValueError("Neighbouring sites must have different colours.")
+        self.order = np.argsort(self.colors, kind='stable').astype(np.int64)
+        self.color_ptr = np.zeros(self.colors.max() + 2, dtype=np.int64)
+        np.cumsum(np.bincount(self.colors), out=self.color_ptr[1:])
+
+
+def _site(shape, *coords):
+    # flat index of a (periodic) lattice position
+    return np.ravel_multi_index([c % L for c, L in zip(coords, shape)], shape)
+
+
+def _anisotropic(j, count):
+    j = np.broadcast_to(np.asarray(j, dtype=np.float64), (count,))
+    return [float(value) for value in j]
+
+
+def square_lattice(L, j = 1.0):
+    """
+    Periodic L x L square lattice, j is one coupling or (j_x, j_y). L must be even.
+    """
+    if L % 2 != 0:
+        raise ValueError("Square lattice needs an even L.")
+    j_x, j_y = _anisotropic(j, 2)
+    x, y = np.indices((L, L)).reshape(2, -1)
+    shape = (L, L)
+    site = _site(shape, x, y)
+    return lattice_geometry(shape,
+                            np.concatenate([site, site]),
+                            np.concatenate([_site(shape, x + 1, y), _site(shape, x, y + 1)]),
+                            np.repeat([j_x, j_y], L * L),
+                            (x + y) % 2)
+
+
+def triangular_lattice(L, j = 1.0):
+    """
+    Periodic triangular lattice on an L x L grid with bonds along x, y and x - y.
+
+    j is one coupling or one per bond direction. Three colours, L must be divisible by 3.
+    """
+    if L % 3 != 0:
+        raise ValueError("Triangular lattice needs L divisible by 3.")
+    j_a, j_b, j_c = _anisotropic(j, 3)
+    x, y = np.indices((L, L)).reshape(2, -1)
+    shape = (L, L)
+    site = _site(shape, x, y)
+    return lattice_geometry(shape,
+                            np.concatenate([site, site, site]),
+                            np.concatenate([_site(shape, x + 1, y),
+                                            _site(shape, x, y + 1),
+                                            _site(shape, x + 1, y - 1)]),
+                            np.repeat([j_a, j_b, j_c], L * L),
+                            (x + 2 * y) % 3)
+
+
+def honeycomb_lattice(L, j = 1.0):
+    """
+    Periodic honeycomb lattice in the brick wall layout on an L x L grid.
+
+    Every site is bonded to its left and right neighbour in the row and to the
+    site above or below, depending on the sublattice. The three bond directions
+    can have their own coupling. L must be even.
+    """
+    if L % 2 != 0:
+        raise ValueError("Honeycomb lattice needs an even L.")
+    j_a, j_b, j_c = _anisotropic(j, 3)
+    x, y = np.indices((L, L)).reshape(2, -1)
+    shape = (L, L)
+    site = _site(shape, x, y)
+    even = (x + y) % 2 == 0
+    return lattice_geometry(shape,
+                            np.concatenate([site, site[even]]),
+                            np.concatenate([_site(shape, x, y + 1), _site(shape, x[even] + 1, y[even])]),
+                            np.concatenate([np.where(even, j_a, j_b), np.full(even.sum(), j_c)]),
+                            (x + y) % 2)
+
+
+def cubic_lattice(L, j = 1.0):
+    """
+    Periodic L x L x L simple cubic lattice, j is one coupling or (j_x, j_y, j_z). L must be even.
+    """
+    if L % 2 != 0:
+        raise ValueError("Cubic lattice needs an even L.")
+    j_x, j_y, j_z = _anisotropic(j, 3)
+    x, y, z = np.indices((L, L, L)).reshape(3, -1)
+    shape = (L, L, L)
+    site = _site(shape, x, y, z)
+    return lattice_geometry(shape,
+                            np.concatenate([site, site, site]),
+                            np.concatenate([_site(shape, x + 1, y, z),
+                                            _site(shape, x, y + 1, z),
+                                            _site(shape, x, y, z + 1)]),
+                            np.repeat([j_x, j_y, j_z], L**3),
+                            (x + y + z) % 2)
+
+
+LATTICES = {'square': square_lattice,
+            'triangular': triangular_lattice,
+            'honeycomb': honeycomb_lattice,
+            'cubic': cubic_lattice}
+
+
+@njit(parallel=True)
+def csr_sweep(spins, indptr, indices, couplings, order, color_ptr, beta, force_B, seed, sweep):
+    """
+    Metropolis sweep over a lattice_geometry, one update attempt per site.
+
+    Colour classes are updated one after another, the sites of a class in
+    parallel blocks of BLOCK_SIZE. Returns the change of the energy and of
+    the spin sum and the number of accepted flips.
+    """
+    n_colors = color_ptr.size - 1
+    n_blocks = 0
+    max_blocks = 0
+    for c in range(n_colors):
+        blocks = (color_ptr[c + 1] - color_ptr[c] + BLOCK_SIZE - 1) // BLOCK_SIZE
+        n_blocks += blocks
+        max_blocks = max(max_blocks, blocks)
+    # per-block accumulators, each block is owned by exactly one thread
+    delta_E = np.zeros(n_blocks)
+    delta_M = np.zeros(n_blocks, dtype=np.int64)
+    accepted = np.zeros(n_blocks, dtype=np.int64)
+    # a regular lattice has only a handful of distinct energy changes, their
+    # acceptance probabilities are computed once per block instead of per attempt;
+    # the caches are allocated once here and reused by the blocks of every colour
+    cached_dE = np.empty((max_blocks, CACHE_SIZE))
+    cached_prob = np.empty((max_blocks, CACHE_SIZE))
+
+    first_block = 0
+    for c in range(n_colors):
+        start = color_ptr[c]
+        stop = color_ptr[c + 1]
+        blocks = (stop - start + BLOCK_SIZE - 1) // BLOCK_SIZE
+        for b in prange(blocks):
+            block = first_block + b
+            state = rng_stream(seed, sweep, np.uint64(block))
+            cached = 0
+            for k in range(start + b * BLOCK_SIZE, min(start + (b + 1) * BLOCK_SIZE, stop)):
+                i = order[k]
+                s_i = spins[i]
+                field = 0.0
+                for e in range(indptr[i], indptr[i + 1]):
+                    field += couplings[e] * spins[indices[e]]
+                dE = 2 * s_i * (field + force_B)
+
+                if dE > 0:
+                    prob = -1.0
+                    for m in range(cached):
+                        if cached_dE[b, m] == dE:
+                            prob = cached_prob[b, m]
+                            break
+                    if prob < 0:
+                        prob = np.exp(-beta * dE)
+                        if cached < CACHE_SIZE:
+                            cached_dE[b, cached] = dE
+                            cached_prob[b, cached] = prob
+                            cached += 1
+                    state, r = rng_next(state)
+                    if r >= prob:
+                        continue
+                spins[i] = -s_i
+                delta_E[block] += dE
+                delta_M[block] -= 2 * s_i
+                accepted[block] += 1
+        first_block += blocks
+
+    return delta_E.sum(), delta_M.sum(), accepted.sum()
+
+
+@njit
+def csr_observables(spins, indptr, indices, couplings, force_B):
+    # every bond is stored twice, hence the 1/2
+    bonds = 0.0
+    total = 0
+    for i in range(spins.size):
+        total += spins[i]
+        for e in range(indptr[i], indptr[i + 1]):
+            bonds += couplings[e] * spins[i] * spins[indices[e]]
+    return (-1) * 0.5 * bonds - force_B * total, total
+
+
+class ising_simulation_lattice:
+    """
+    Class for simulating the Ising model on any lattice_geometry with Metropolis updates.
+
+    Square, triangular, honeycomb and cubic lattices with anisotropic couplings
+    are built by the functions in LATTICES, the couplings live in the geometry.
+    The observables API is the same as in the other simulation classes.
+
+    Attributes:
+        geometry (lattice_geometry): Lattice, bonds and couplings.
+        beta (float): Inverse temperature (1/kT).
+        force_B (float): External magnetic field strength.
+        bigsteps (int): Number of big steps.
+        ups_density (float): Initial density of up spins (+1).
+        magnetisation_filename (str): Directory for the recorded observables (see ising_recorder).
+        seed (int): Seed of the simulation, a fresh one is drawn and stored when None.
+        stream_id (int): Stream of the seed used by this simulation.
+        sweep (int): Number of sweeps performed so far.
+        M (np.ndarray): int8 spins with geometry.shape.
+        hamiltionian (float): Running total of the energy.
+        total_spin (int): Running sum of all spins.
+        acceptance (float): Flipped spins per site in the last big step.
+
+    Methods:
+        recalculate_observables(): Recomputes the running energy and magnetisation totals from the lattice.
+        calculate_hamiltionian(): Calculates and prints the Hamiltonian of the current configuration.
+        big_step(): Performs a full sweep of colour-ordered Metropolis updates with csr_sweep.
+        save_M(step, create_file=False): Records step, magnetisation, energy and acceptance rate.
+        close_recorder(): Flushes and closes the observable recorder used by save_M.
+        simulate(): Runs the simulation for the specified number of big steps.
+        simulate_adaptive(target_error, observable='abs_M', check_every=100, max_steps=None): Runs until
+            the equilibrium mean of the observable is known to target_error.
+        calculate_M(): Returns the magnetization of the current configuration from the running total.
+    """
+    def __init__(self,
+                 geometry,
+                 beta,
+                 force_B,
+                 amount_of_steps,
+                 ups_density = 0.5,
+                 magnetisation_filename = None,
+                 seed = None,
+                 stream_id = 0):
+        self.geometry = geometry
+        self.beta = beta
+        self.force_B = force_B
+        self.bigsteps = amount_of_steps
+        self.ups_density = ups_density
+        self.magnetisation_filename = magnetisation_filename
+        self.recorder = None
+        self.acceptance = 0.0
+        if seed == None:
+            seed = new_seed()
+        self.seed = int(seed)
+        self.stream_id = stream_id
+        self.rng = make_generator(self.seed, self.stream_id)
+        self.kernel_seed = stream_seed(self.seed, self.stream_id)
+        self.sweep = 0
+
+        self.M = (-1)*np.ones(geometry.shape, dtype=np.int8)
+        amount_of_ups = int(self.ups_density * self.M.size)
+        idxes = self.rng.choice(self.M.size, amount_of_ups, replace=False)
+        self.M.flat[idxes] = 1
+        self.recalculate_observables()
+
+
+    def recalculate_observables(self):
+        g = self.geometry
+        energy, total = csr_observables(self.M.reshape(-1), g.indptr, g.indices, g.couplings,
+                                        float(self.force_B))
+        self.hamiltionian = energy
+        self.total_spin = int(total)
+
+
+    def calculate_hamiltionian(self):
+        self.recalculate_observables()
+        print(self.hamiltionian)
+
+
+    def big_step(self):
+        g = self.geometry
+        delta_E, delta_M, accepted = csr_sweep(self.M.reshape(-1), g.indptr, g.indices, g.couplings,
+                                               g.order, g.color_ptr, float(self.beta), float(self.force_B),
+                                               self.kernel_seed, np.uint64(self.sweep))
+        self.hamiltionian += delta_E
+        self.total_spin += int(delta_M)
+        self.acceptance = accepted / self.M.size
+        self.sweep += 1
+
+
+    def calculate_M(self):
+        return 1/self.M.size * self.total_spin
+
+
+    def save_M(self, step, create_file=False):
+        if self.magnetisation_filename != None:
+            if create_file == True or self.recorder == None:
+                self.close_recorder()
+                self.recorder = observable_recorder(self.magnetisation_filename)
+            self.recorder.record(step, self.calculate_M(), self.hamiltionian, self.acceptance)
+
+
+    def close_recorder(self):
+        if self.recorder != None:
+            self.recorder.close()
+            self.recorder = None
+
+
+    @TimerDecorator
+    def simulate(self):
+        for _ in range(self.bigsteps):
+            self.big_step()
+
+
+    @TimerDecorator
+    def simulate_adaptive(self, target_error, observable='abs_M', check_every=100, max_steps=None):
+        try:
+            return adaptive_sampling(self, target_error, observable, check_every, max_steps)
+        finally:
+            self.close_recorder()
+
+
+if __name__ == "__main__":
+    for name, beta in [('square', 0.5), ('triangular', 0.35), ('honeycomb', 0.7), ('cubic', 0.3)]:
+        L = 24 if name == 'cubic' else 96
+        sim = ising_simulation_lattice(LATTICES[name](L), beta=beta, force_B=0, amount_of_steps=200)
+        sim.simulate()
+        print(f"{name}: <M> = {sim.calculate_M():.4f}")
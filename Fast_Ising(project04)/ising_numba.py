@@ -1,38 +1,92 @@
 import numpy as np
-from PIL import Image, ImageDraw
 from scipy import signal
-from decorator01 import TimerDecorator
-from numba import njit
+from decorator01 import TimerDecorator, print_stats
+from ising_render import render_frame, spin_indices
+from ising_animation import open_animation
+from ising_recorder import observable_recorder
+from ising_checkpoint import save_checkpoint
+from ising_analysis import adaptive_sampling
+from boltzmann import boltzmann_acceptance
+from ising_rng import new_seed, make_generator, stream_seed, rng_stream, rng_next
+from numba import njit, prange
 
 
-def metropolis_sweep(M, j, beta, force_B):
-    n = M.shape[0]
+# Acceptance probabilities come from boltzmann_table, the entry of a spin s_i
+# with neighbour sum n sits at 5 * (s_i > 0) + (n + 4) // 2.
+# The kernels return the change of the energy and of the spin sum and the number
+# of accepted flips, so the class can keep its observables without another pass over M.
+@njit
+def metropolis_sweep(M, table, j, force_B, seed, sweep):
+    N = M.shape[0]
+    state = rng_stream(seed, sweep, np.uint64(0))
+    delta_E = 0.0
+    delta_M = 0
+    accepted = 0
 
-    for _ in range(n):
-        idx_x = np.random.randint(0, M.shape[0])
-        idx_y = np.random.randint(0, M.shape[1])
+    for _ in range(M.size):
+        state, r = rng_next(state)
+        idx_x = int(r * N)
+        state, r = rng_next(state)
+        idx_y = int(r * N)
         s_i = M[idx_x, idx_y]
 
         # periodic boundary conditions
-        N = M.shape[0]
-        s_up    = M[(idx_x - 1) % N, idx_y]
-        s_down  = M[(idx_x + 1) % N, idx_y]
-        s_left  = M[idx_x, (idx_y - 1) % N]
-        s_right = M[idx_x, (idx_y + 1) % N]
-
-        E_0 = -j * s_i * (s_up + s_down + s_left + s_right) - force_B * s_i
-        E_1 = -j * (-s_i) * (s_up + s_down + s_left + s_right) - force_B * (-s_i)
-
-        delta_E = E_1 - E_0
-        if delta_E < 0:
-            M[idx_x, idx_y] *= (-1)
-        else:
-            prob = np.exp( (-1) * beta * delta_E )
-            if np.random.rand() < prob:
-                M[idx_x, idx_y] *= (-1)
+        neighbours = M[(idx_x - 1) % N, idx_y] + M[(idx_x + 1) % N, idx_y] \
+                   + M[idx_x, (idx_y - 1) % N] + M[idx_x, (idx_y + 1) % N]
+
+        prob = table[5 * (s_i > 0) + (neighbours + 4) // 2]
+        if prob < 1.0:
+            state, r = rng_next(state)
+            if r >= prob:
+                continue
+        M[idx_x, idx_y] = -s_i
+        delta_E += 2 * s_i * (j * neighbours + force_B)
+        delta_M -= 2 * s_i
+        accepted += 1
 
+    return delta_E, delta_M, accepted
 
-class ising_simulation_numba:
+
+@njit(parallel=True)
+def checkerboard_sweep(M, table, j, force_B, seed, sweep):
+    """
+    Red/black Metropolis sweep, N*N update attempts per call.
+
+    Spins of one colour have no neighbours of the same colour, so each
+    half-sweep updates all rows in parallel. Every row of every half-sweep
+    draws from its own random stream. Requires an even lattice size.
+    """
+    N = M.shape[0]
+    # per-row accumulators, each row is owned by exactly one thread
+    delta_E = np.zeros(N)
+    delta_M = np.zeros(N, dtype=np.int64)
+    accepted = np.zeros(N, dtype=np.int64)
+
+    for color in range(2):
+        for idx_x in prange(N):
+            state = rng_stream(seed, sweep, np.uint64(2 * idx_x + color))
+            x_up = (idx_x - 1) % N
+            x_down = (idx_x + 1) % N
+
+            for idx_y in range((idx_x + color) % 2, N, 2):
+                s_i = M[idx_x, idx_y]
+                neighbours = M[x_up, idx_y] + M[x_down, idx_y] \
+                           + M[idx_x, (idx_y - 1) % N] + M[idx_x, (idx_y + 1) % N]
+
+                prob = table[5 * (s_i > 0) + (neighbours + 4) // 2]
+                if prob < 1.0:
+                    state, r = rng_next(state)
+                    if r >= prob:
+                        continue
+                M[idx_x, idx_y] = -s_i
+                delta_E[idx_x] += 2 * s_i * (j * neighbours + force_B)
+                delta_M[idx_x] -= 2 * s_i
+                accepted[idx_x] += 1
+
+    return delta_E.sum(), delta_M.sum(), accepted.sum()
+
+
+class ising_simulation_numba(boltzmann_acceptance):
     """
     Class for simulating 2D Ising model using Metropolis algorithm.
 
@@ -44,15 +98,39 @@ class ising_simulation_numba:
         bigsteps (int): Number of big steps (each consisting of multiple small steps).
         ups_density (float): Initial density of up spins (+1).
         img_filename (str): Filename to save the final spin configuration image.
-        animation_filename (str): Filename to save the animation of the simulation.
-        magnetisation_filename (str): Filename to save the magnetization data.
+        animation_filename (str): Filename to save the animation of the simulation, a '.gif' file is
+            written frame by frame, any other name is a directory of compressed frame chunks.
+        animation_stride (int): Only every animation_stride-th drawn step is added to the animation.
+        magnetisation_filename (str): Directory for the recorded observables, one .npy file per
+            column (see ising_recorder, export_text gives the old text format).
+        step (int): Number of big steps done by the current simulate() run, restored by ising_checkpoint.resume.
+        acceptance (float): Flipped spins per lattice site in the last big step (above 1 is possible for cluster engines).
+        hamiltionian (float): Running total of the energy, updated by every accepted flip.
+        total_spin (int): Running sum of all spins, updated by every accepted flip.
+        engine (str): Sweep engine used by big_step, 'random' (sequential random-site
+            updates), 'checkerboard' (parallel red/black updates, even arr_size only),
+            'wolff' or 'swendsen_wang' (cluster updates, see ising_cluster).
+        seed (int): Seed of the simulation, a fresh one is drawn and stored when None.
+        stream_id (int): Stream of the seed used by this simulation, give parallel runs different ids.
+        rng (np.random.Generator): Generator of the stream, used for the initial lattice.
+        kernel_seed (np.uint64): Seed of the counter-based streams of the compiled kernels,
+            derived from (seed, stream_id); together with the sweep counter it fixes every random number.
+        sweep (int): Number of sweeps performed so far.
 
     Methods:
-        show_array(): Displays the current spin configuration as an image.
+        draw_array(number, show=False, mode='P'): Renders the spin configuration with ising_render, in palette or RGB mode.
+        close_animation(): Finishes the animation file written by draw_array.
+        save_M(step, create_file=False): Records step, magnetisation, energy and acceptance rate.
+        close_recorder(): Flushes and closes the observable recorder used by save_M.
         calculate_hamiltionian(): Calculates and prints the Hamiltonian of the current configuration.
-        big_step(): Performs a full sweep of Metropolis updates over the entire lattice implemented with numba function.
-        simulate(): Runs the simulation for the specified number of big steps.
-        calculate_M(): Calculates and returns the magnetization of the current configuration.
+        recalculate_observables(): Recomputes the running energy and magnetisation totals from the lattice.
+        acceptance_table(): Returns Metropolis acceptance probabilities, rebuilt when j, beta or force_B change.
+        big_step(engine=None): Performs a full sweep of N*N Metropolis updates with the selected numba engine.
+        simulate(checkpoint_dir=None, checkpoint_every=100): Runs the simulation for the specified number
+            of big steps, saving a checkpoint every checkpoint_every steps if checkpoint_dir is given.
+        simulate_adaptive(target_error, observable='abs_M', check_every=100, max_steps=None): Runs until
+            the equilibrium mean of the observable is known to target_error, see ising_analysis.adaptive_sampling.
+        calculate_M(): Returns the magnetization of the current configuration from the running total.
     """
     def __init__(self, 
                  arr_size, 
@@ -63,7 +141,11 @@ class ising_simulation_numba:
                  ups_density = 0.5, 
                  img_filename = None,
                  animation_filename = None,
-                 magnetisation_filename = None):
+                 magnetisation_filename = None,
+                 animation_stride = 1,
+                 engine = 'random',
+                 seed = None,
+                 stream_id = 0):
         self.j = j
         self.beta = beta
         self.force_B = force_B
@@ -71,84 +153,134 @@ class ising_simulation_numba:
         self.ups_density = ups_density
         self.img_filename = img_filename
         self.animation_filename = animation_filename
-        if animation_filename != None:
-            self.animation_frames = []
+        self.animation_stride = animation_stride
+        self.animation_sink = None
         self.magnetisation_filename = magnetisation_filename
         self.hamiltionian = 0
+        self.acceptance = 0.0
+        self.step = 0
+        self.recorder = None
+        self.engine = engine
+        if seed == None:
+            seed = new_seed()
+        self.seed = int(seed)
+        self.stream_id = stream_id
+        self.rng = make_generator(self.seed, self.stream_id)
+        self.kernel_seed = stream_seed(self.seed, self.stream_id)
+        self.sweep = 0
+        self._table = None
+        self._table_key = None
         self.neighborhood_kernel = np.array([[0, 1, 0],
                                                 [1, 0, 1],
                                                 [0, 1, 0]])
 
         self.M = (-1)*np.ones([arr_size, arr_size], dtype=np.int8)
         amount_of_ups = int(self.ups_density * self.M.size)
-        idxes = np.random.choice(self.M.size, amount_of_ups, replace=False)
+        idxes = self.rng.choice(self.M.size, amount_of_ups, replace=False)
         self.M.flat[idxes] = 1
+        self.recalculate_observables()
 
 
-    def draw_array(self, number, show=False):
-        image_size = 1000
-        image = Image.new('RGB', (image_size, image_size), 'black')
-        draw = ImageDraw.Draw(image)
-
-        red_color = '#f0827a'
-        blue_color = '#7ab3f0'
+    @TimerDecorator
+    def draw_array(self, number, show=False, mode='P'):
+        if show == True or self.img_filename != None:
+            image = render_frame(self.M, mode)
 
-        matrix_width = self.M.shape[0]
-        dw = np.floor(image_size/matrix_width)
-        color = 'white'
-        for x in range(matrix_width):
-            for y in range(matrix_width):
-                if self.M[x,y] == 1:
-                    color = red_color
-                else:
-                    color = blue_color
+            if show == True:
+                image.show()
 
-                draw.rectangle([x*dw, y*dw, (x+1)*dw, (y+1)*dw], fill=color)
+            if self.img_filename != None:
+                image.save(f'{self.img_filename}{number:04d}.png')
 
-        if show == True:
-            image.show()
+        if self.animation_filename != None and number % self.animation_stride == 0:
+            if self.animation_sink == None:
+                self.animation_sink = open_animation(self.animation_filename)
+            self.animation_sink.add_frame(spin_indices(self.M))
 
-        if self.img_filename != None:
-            image.save(f'{self.img_filename}{number:04d}.png')
 
-        if self.animation_filename != None:
-            self.animation_frames.append(image)
+    def close_animation(self):
+        if self.animation_sink != None:
+            self.animation_sink.close()
+            self.animation_sink = None
 
 
-    def calculate_hamiltionian(self):
+    def recalculate_observables(self):
+        # full O(N^2) pass, the sweeps keep both totals up to date afterwards
+        self.total_spin = int(self.M.sum())
         self.hamiltionian = (-1) * 1/2 * self.j * (  \
-                self.M * signal.convolve2d(self.M, self.neighborhood_kernel, mode = 'same') \
+                self.M * signal.convolve2d(self.M, self.neighborhood_kernel, mode = 'same', boundary = 'wrap') \
                     ).sum() \
-            - self.force_B * self.M.sum()
+            - self.force_B * self.total_spin
+
+
+    def calculate_hamiltionian(self):
+        self.recalculate_observables()
         print(self.hamiltionian)
   
 
-    def big_step(self):
-        metropolis_sweep(self.M, self.j, self.beta, self.force_B)
+    @TimerDecorator
+    def big_step(self, engine=None):
+        if engine == None:
+            engine = self.engine
+
+        table = self.acceptance_table()
+        # fixed argument types, so ints and floats do not compile separate kernels
+        j = float(self.j)
+        force_B = float(self.force_B)
+        seed = self.kernel_seed
+        sweep = np.uint64(self.sweep)
+        if engine == 'random':
+            delta_E, delta_M, accepted = metropolis_sweep(self.M, table, j, force_B, seed, sweep)
+        elif engine == 'checkerboard':
+            if self.M.shape[0] % 2 != 0:
+                raise ValueError("Checkerboard engine requires an even arr_size.")
+            delta_E, delta_M, accepted = checkerboard_sweep(self.M, table, j, force_B, seed, sweep)
+        elif engine == 'wolff' or engine == 'swendsen_wang':
+            from ising_cluster import cluster_sweep
+            delta_E, delta_M, accepted = cluster_sweep(engine, self.M, j, float(self.beta), force_B, seed, sweep)
+        else:
+            raise ValueError(f"Unknown engine: {engine}")
+        self.hamiltionian += delta_E
+        self.total_spin += int(delta_M)
+        self.acceptance = accepted / self.M.size
+        self.sweep += 1
 
 
     # Visualisation and output methods
     def calculate_M(self):
-        return 1/self.M.size * self.M.sum()
+        return 1/self.M.size * self.total_spin
     
 
     def save_M(self, step, create_file=False):
         if self.magnetisation_filename != None:
-            if create_file == True:
-                with open(self.magnetisation_filename, 'w') as f:
-                    f.write('Step\tMagnetisation\n')
+            if create_file == True or self.recorder == None:
+                self.close_recorder()
+                self.recorder = observable_recorder(self.magnetisation_filename)
+            self.recorder.record(step, self.calculate_M(), self.hamiltionian, self.acceptance)
+
 
-            with open(self.magnetisation_filename, 'a') as f:
-                f.write(f'{step}\t{self.calculate_M()}\n')
+    def close_recorder(self):
+        if self.recorder != None:
+            self.recorder.close()
+            self.recorder = None
 
 
     @TimerDecorator
-    def simulate(self):
-        i = 0
-        i += 1
-        for _ in range(self.bigsteps):
+    def simulate(self, checkpoint_dir=None, checkpoint_every=100):
+        while self.step < self.bigsteps:
             self.big_step()
-            i += 1
+            self.step += 1
+            if checkpoint_dir != None and self.step % checkpoint_every == 0:
+                save_checkpoint(self, checkpoint_dir)
+        self.step = 0
+
+
+    @TimerDecorator
+    def simulate_adaptive(self, target_error, observable='abs_M', check_every=100, max_steps=None):
+        try:
+            return adaptive_sampling(self, target_error, observable, check_every, max_steps)
+        finally:
+            self.close_recorder()
 
 
 if __name__ == "__main__":
@@ -159,4 +291,4 @@ if __name__ == "__main__":
                             amount_of_steps = 3, 
                             ups_density = 0.65)
     sim.simulate()
-    sim.simulate.print_stats()
\ No newline at end of file
+    print_stats(sim.simulate)
\ No newline at end of file
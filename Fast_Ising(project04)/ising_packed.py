@@ -0,0 +1,279 @@
+import numpy as np
+from numba import njit, prange
+from decorator01 import TimerDecorator, print_stats
+from boltzmann import boltzmann_acceptance
+from ising_rng import new_seed, make_generator, stream_seed, rng_stream, rng_next
+
+
+# Multi-spin coding: row r of an N x N lattice is stored in W = N / 64 words,
+# spin (r, k * W + w) is bit k of word P[r, w] (bit set = spin up). The left and
+# right neighbours of all 64 spins of a word are then the same bits of words
+# w - 1 and w + 1, only the words at the row ends need a one bit rotation.
+EVEN_BITS = np.uint64(0x5555555555555555)
+ODD_BITS = np.uint64(0xAAAAAAAAAAAAAAAA)
+ALL_BITS = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+@njit
+def _popcount(x):
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+@njit
+def _left(P, r, w):
+    W = P.shape[1]
+    if w > 0:
+        return P[r, w - 1]
+    x = P[r, W - 1]
+    return (x << np.uint64(1)) | (x >> np.uint64(63))
+
+
+@njit
+def _right(P, r, w):
+    W = P.shape[1]
+    if w < W - 1:
+        return P[r, w + 1]
+    x = P[r, 0]
+    return (x >> np.uint64(1)) | (x << np.uint64(63))
+
+
+@njit
+def _color_mask(r, w, W, color):
+    # colour of spin (r, k * W + w) is (r + k * W + w) % 2
+    if W % 2 == 0:
+        return ALL_BITS if (r + w) % 2 == color else np.uint64(0)
+    return EVEN_BITS if (r + w) % 2 == color else ODD_BITS
+
+
+@njit(parallel=True)
+def packed_sweep(P, table, j, force_B, seed, sweep):
+    """
+    Red/black Metropolis sweep on a bit-packed lattice.
+
+    The number of antiparallel neighbours of 64 spins at once is summed with
+    bitwise adders into three bit planes. Together with the spin bit it selects
+    one of the 10 entries of the acceptance table: classes with probability 1
+    are flipped with one bitwise OR, random numbers are drawn only for spins
+    in the remaining classes. Rows of one parity are processed in parallel, so
+    no thread reads a word another thread is writing.
+
+    Returns the change of energy and of the spin sum.
+    """
+    N, W = P.shape
+    delta_E = np.zeros(N)
+    delta_M = np.zeros(N, dtype=np.int64)
+
+    for color in range(2):
+        for parity in range(2):
+            for half in prange(N // 2):
+                r = 2 * half + parity
+                state = rng_stream(seed, sweep, np.uint64(2 * r + color))
+                r_up = (r - 1) % N
+                r_down = (r + 1) % N
+
+                for w in range(W):
+                    mask = _color_mask(r, w, W, color)
+                    if mask == 0:
+                        continue
+                    s = P[r, w]
+                    a1 = s ^ P[r_up, w]
+                    a2 = s ^ P[r_down, w]
+                    a3 = s ^ _left(P, r, w)
+                    a4 = s ^ _right(P, r, w)
+
+                    # bit-sliced count of antiparallel neighbours, c2 c1 c0
+                    x0 = a1 ^ a2
+                    x1 = a1 & a2
+                    y0 = a3 ^ a4
+                    y1 = a3 & a4
+                    c0 = x0 ^ y0
+                    carry = x0 & y0
+                    c1 = x1 ^ y1 ^ carry
+                    c2 = (x1 & y1) | ((x1 ^ y1) & carry)
+
+                    flip = np.uint64(0)
+                    for anti in range(5):
+                        if anti == 4:
+                            count_mask = c2
+                        else:
+                            count_mask = ~c2
+                            count_mask &= c1 if anti & 2 else ~c1
+                            count_mask &= c0 if anti & 1 else ~c0
+
+                        for up in range(2):
+                            cls = count_mask & mask & (s if up else ~s)
+                            if cls == 0:
+                                continue
+                            # s_i * (sum of neighbours) is 4 - 2 * anti for both spin values
+                            prob = table[5 + 4 - anti] if up else table[anti]
+                            if prob < 1.0:
+                                accepted = np.uint64(0)
+                                while cls != 0:
+                                    low = cls & (~cls + np.uint64(1))
+                                    state, u = rng_next(state)
+                                    if u < prob:
+                                        accepted |= low
+                                    cls ^= low
+                                cls = accepted
+                                if cls == 0:
+                                    continue
+                            flip |= cls
+                            flips = np.int64(_popcount(cls))
+                            s_i = 2 * up - 1
+                            delta_E[r] += flips * 2 * (j * (4 - 2 * anti) + s_i * force_B)
+                            delta_M[r] -= flips * 2 * s_i
+
+                    P[r, w] = s ^ flip
+
+    return delta_E.sum(), delta_M.sum()
+
+
+@njit
+def packed_observables(P):
+    # number of up spins and of antiparallel bonds (right and down bond of every spin)
+    N, W = P.shape
+    ups = 0
+    anti = 0
+    for r in range(N):
+        for w in range(W):
+            s = P[r, w]
+            ups += _popcount(s)
+            anti += _popcount(s ^ _right(P, r, w)) + _popcount(s ^ P[(r + 1) % N, w])
+    return ups, anti
+
+
+def pack(M):
+    """
+    Packs rows of +-1 spins (int8, row length divisible by 64) into the multi-spin coded layout.
+    """
+    rows, N = M.shape
+    if N % 64 != 0:
+        raise ValueError("Packed rows must have a length divisible by 64.")
+    bits = (M > 0).reshape(rows, 64, N // 64).astype(np.uint64)
+    shifts = np.arange(64, dtype=np.uint64)[None, :, None]
+    return (bits << shifts).sum(axis=1, dtype=np.uint64)
+
+
+def unpack(P):
+    """
+    Unpacks a multi-spin coded lattice into an int8 array of +-1 spins.
+    """
+    N = P.shape[0]
+    shifts = np.arange(64, dtype=np.uint64)[None, :, None]
+    bits = (P[:, None, :] >> shifts) & np.uint64(1)
+    return (2 * bits.reshape(N, N).astype(np.int8) - 1)
+
+
+class ising_simulation_packed(boltzmann_acceptance):
+    """
+    Class for simulating 2D Ising model with a bit-packed (multi-spin coded) lattice.
+
+    Spins are stored 64 per uint64 word, 8 times less memory than the int8 lattice
+    of ising_simulation_numba, and updated with bitwise Metropolis sweeps.
+    The observables API is the same as in the other simulation classes.
+
+    Attributes:
+        arr_size (int): Size of the square lattice, must be divisible by 64.
+        j (float): Interaction strength between neighboring spins.
+        beta (float): Inverse temperature (1/kT).
+        force_B (float): External magnetic field strength.
+        bigsteps (int): Number of big steps.
+        ups_density (float): Probability of a spin being up (+1) in the initial lattice.
+        seed (int): Seed of the random streams.
+        stream_id (int): Stream of the seed used by this simulation, give parallel runs different ids.
+        sweep (int): Number of sweeps performed so far.
+        P (np.ndarray): Packed lattice, shape (arr_size, arr_size // 64), dtype uint64.
+        hamiltionian (float): Running total of the energy.
+        total_spin (int): Running sum of all spins.
+
+    Methods:
+        lattice(): Returns the unpacked int8 lattice, e.g. for drawing.
+        calculate_hamiltionian(): Calculates and prints the Hamiltonian of the current configuration.
+        recalculate_observables(): Recomputes the running energy and magnetisation totals from the lattice.
+        acceptance_table(): Returns Metropolis acceptance probabilities, rebuilt when j, beta or force_B change.
+        big_step(): Performs a full sweep of N*N Metropolis updates on the packed lattice.
+        simulate(): Runs the simulation for the specified number of big steps.
+        calculate_M(): Returns the magnetization of the current configuration from the running total.
+    """
+    def __init__(self,
+                 arr_size,
+                 j,
+                 beta,
+                 force_B,
+                 amount_of_steps,
+                 ups_density = 0.5,
+                 seed = None,
+                 stream_id = 0):
+        if arr_size % 64 != 0:
+            raise ValueError("Packed lattices need an arr_size divisible by 64.")
+        self.j = j
+        self.beta = beta
+        self.force_B = force_B
+        self.bigsteps = amount_of_steps
+        self.ups_density = ups_density
+        if seed == None:
+            seed = new_seed()
+        self.seed = int(seed)
+        self.stream_id = stream_id
+        self.kernel_seed = stream_seed(self.seed, self.stream_id)
+        self.sweep = 0
+        self.hamiltionian = 0
+        self._table = None
+        self._table_key = None
+
+        # built 64 rows at a time, so the unpacked lattice never exists in memory
+        rng = make_generator(self.seed, self.stream_id)
+        self.P = np.empty((arr_size, arr_size // 64), dtype=np.uint64)
+        for r in range(0, arr_size, 64):
+            rows = np.where(rng.random((64, arr_size)) < self.ups_density, 1, -1).astype(np.int8)
+            self.P[r:r + 64] = pack(rows)
+        self.recalculate_observables()
+
+
+    def lattice(self):
+        return unpack(self.P)
+
+
+    def recalculate_observables(self):
+        ups, anti = packed_observables(self.P)
+        N = self.P.shape[0]
+        self.total_spin = int(2 * ups - N * N)
+        self.hamiltionian = (-1) * self.j * (2 * N * N - 2 * int(anti)) - self.force_B * self.total_spin
+
+
+    def calculate_hamiltionian(self):
+        self.recalculate_observables()
+        print(self.hamiltionian)
+
+
+    def big_step(self):
+        delta_E, delta_M = packed_sweep(self.P, self.acceptance_table(), float(self.j), float(self.force_B),
+                                        self.kernel_seed, np.uint64(self.sweep))
+        self.hamiltionian += delta_E
+        self.total_spin += int(delta_M)
+        self.sweep += 1
+
+
+    def calculate_M(self):
+        return 1/self.P.shape[0]**2 * self.total_spin
+
+
+    @TimerDecorator
+    def simulate(self):
+        for _ in range(self.bigsteps):
+            self.big_step()
+
+
+if __name__ == "__main__":
+    sim = ising_simulation_packed(arr_size=1024,
+                                  j=1,
+                                  beta=0.5,
+                                  force_B=0,
+                                  amount_of_steps=20,
+                                  ups_density=0.65)
+    sim.simulate()
+    print_stats(sim.simulate)
+    print(sim.calculate_M())
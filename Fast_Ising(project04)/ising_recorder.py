@@ -0,0 +1,135 @@
+import os
+import numpy as np
+
+
+COLUMNS = (('step', np.int64),
+           ('M', np.float64),
+           ('E', np.float64),
+           ('acceptance', np.float64))
+
+# Fixed size .npy header, rewritten in place after every flush. The column
+# files are therefore valid .npy arrays (loadable with mmap_mode) at any time.
+HEADER_SIZE = 128
+
+
+def _npy_header(dtype, length):
+    header = repr({'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                   'fortran_order': False,
+                   'shape': (length,)})
+    header = header.encode('latin1').ljust(HEADER_SIZE - 10 - 1) + b'\n'
+    return b'\x93NUMPY\x01\x00' + np.uint16(len(header)).tobytes() + header
+
+
+class observable_recorder:
+    """
+    Buffered, columnar recorder of per-step observables.
+
+    Values are written into preallocated NumPy buffers and appended to one .npy
+    file per column (step, M, E, acceptance) every block_size rows, instead of
+    formatting and writing a line of text per step.
+
+    Attributes:
+        directory (str): Directory with the column files, created if needed.
+        block_size (int): Number of rows buffered in memory between writes.
+        rows (int): Number of rows recorded so far, including buffered ones.
+
+    Methods:
+        record(step, M, E, acceptance): Adds one row.
+        flush(): Appends the buffered rows to the column files.
+        checkpoint(): Flushes and returns the number of rows, to reopen the recorder later with offset.
+        close(): Flushes and closes the column files.
+    """
+    def __init__(self, directory, block_size=4096, offset=None):
+        """
+        With offset=None the column files are created empty, otherwise existing
+        files are truncated to `offset` rows and recording continues after them.
+        """
+        self.directory = directory
+        self.block_size = block_size
+        os.makedirs(directory, exist_ok=True)
+
+        self._buffers = [np.empty(block_size, dtype=dtype) for _, dtype in COLUMNS]
+        self._filled = 0
+        self._files = []
+        for name, dtype in COLUMNS:
+            path = os.path.join(directory, f'{name}.npy')
+            if offset == None:
+                f = open(path, 'wb+')
+                f.write(_npy_header(dtype, 0))
+            else:
+                f = open(path, 'rb+')
+                f.truncate(HEADER_SIZE + offset * np.dtype(dtype).itemsize)
+                f.seek(0)
+                f.write(_npy_header(dtype, offset))
+            self._files.append(f)
+        self._written = 0 if offset == None else offset
+
+
+    @property
+    def rows(self):
+        return self._written + self._filled
+
+
+    def record(self, step, M, E, acceptance):
+        i = self._filled
+        self._buffers[0][i] = step
+        self._buffers[1][i] = M
+        self._buffers[2][i] = E
+        self._buffers[3][i] = acceptance
+        self._filled += 1
+        if self._filled == self.block_size:
+            self.flush()
+
+
+    def flush(self):
+        if self._filled == 0:
+            return
+        self._written += self._filled
+        for f, buffer, (_, dtype) in zip(self._files, self._buffers, COLUMNS):
+            f.seek(0, os.SEEK_END)
+            f.write(buffer[:self._filled].tobytes())
+            f.seek(0)
+            f.write(_npy_header(dtype, self._written))
+            f.flush()
+        self._filled = 0
+
+
+    def checkpoint(self):
+        self.flush()
+        return self._written
+
+
+    def close(self):
+        self.flush()
+        for f in self._files:
+            f.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_observables(directory, mmap_mode='r'):
+    """
+    Loads the columns written by observable_recorder, memory-mapped by default.
+
+    Returns:
+        dict: Column name -> np.ndarray.
+    """
+    return {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+            for name, _ in COLUMNS}
+
+
+def export_text(directory, filename):
+    """
+    Post-processing export of recorded observables to a tab separated text file.
+    """
+    columns = load_observables(directory)
+    with open(filename, 'w') as f:
+        f.write('Step\tMagnetisation\tEnergy\tAcceptance\n')
+        for row in zip(*(columns[name] for name, _ in COLUMNS)):
+            f.write('\t'.join(str(value) for value in row) + '\n')
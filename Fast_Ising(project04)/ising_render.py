@@ -0,0 +1,53 @@
+import numpy as np
+from PIL import Image
+
+
+IMAGE_SIZE = 1000
+# palette index 0 is the background, 1 a spin down, 2 a spin up
+PALETTE = [0x00, 0x00, 0x00,
+           0x7a, 0xb3, 0xf0,
+           0xf0, 0x82, 0x7a]
+
+
+def spin_indices(M):
+    """
+    Maps a lattice of +-1 spins to palette indices, one uint8 per spin.
+
+    The lattice is transposed, so the first lattice index runs along the image x axis.
+    """
+    return np.where(M.T == 1, 2, 1).astype(np.uint8)
+
+
+def upscale(indices, image_size=IMAGE_SIZE):
+    """
+    Nearest-neighbour upscaling of a frame of palette indices to image_size x image_size.
+
+    Every spin becomes a square of image_size // N pixels, what does not fit is left as background.
+    Like the rectangles of the original ImageDraw renderer, which included
+    their far edge, the last spins also colour the pixel row and column n * dw.
+    """
+    n = indices.shape[0]
+    dw = max(image_size // n, 1)
+    pixels = np.minimum(np.arange(min(n * dw + 1, image_size)) // dw, n - 1)
+    frame = np.zeros((image_size, image_size), dtype=np.uint8)
+    frame[:pixels.size, :pixels.size] = indices[np.ix_(pixels, pixels)]
+    return frame
+
+
+def to_image(frame, mode='P'):
+    """
+    Converts a frame of palette indices into a PIL image, in palette ('P') or 'RGB' mode.
+    """
+    if mode == 'P':
+        image = Image.fromarray(frame, mode='P')
+        image.putpalette(PALETTE)
+        return image
+    if mode == 'RGB':
+        colors = np.array(PALETTE, dtype=np.uint8).reshape(-1, 3)
+        return Image.fromarray(colors[frame], mode='RGB')
+    raise ValueError(f"Unknown image mode: {mode}")
+
+
+def render_frame(M, mode='P', image_size=IMAGE_SIZE):
+    return to_image(upscale(spin_indices(M), image_size), mode)
+
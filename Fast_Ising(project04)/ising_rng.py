@@ -0,0 +1,132 @@
+import numpy as np
+try:
+    from numba import njit
+except ImportError:
+    # the Generator helpers work without numba, rng_stream/rng_next then run as plain Python
+    def njit(func):
+        def wrapper(*args):
+            # the uint64 arithmetic wraps on purpose
+            with np.errstate(over='ignore'):
+                return func(*args)
+        return wrapper
+
+
+BIT_GENERATORS = {'philox': np.random.Philox,
+                  'pcg64': np.random.PCG64}
+
+
+def new_seed():
+    """
+    Fresh random seed from OS entropy, stored by the simulations so every run can be repeated.
+    """
+    return int(np.random.SeedSequence().entropy)
+
+
+def make_generator(seed, stream_id=0, bit_generator='philox'):
+    """
+    Independent random stream number `stream_id` of the seed `seed`.
+
+    Streams are derived with np.random.SeedSequence spawn keys, so different
+    stream ids (threads, processes, replicas) never overlap and the same
+    (seed, stream_id) always gives the same numbers.
+
+    Returns:
+        np.random.Generator: Generator backed by Philox (counter-based) or PCG64.
+    """
+    sequence = np.random.SeedSequence(seed, spawn_key=(stream_id,))
+    return np.random.Generator(BIT_GENERATORS[bit_generator](sequence))
+
+
+def stream_seed(seed, stream_id=0):
+    """
+    64 bit seed of stream `stream_id`, for the counter-based streams of the compiled kernels.
+    """
+    sequence = np.random.SeedSequence(seed, spawn_key=(stream_id,))
+    return np.uint64(sequence.generate_state(1, dtype=np.uint64)[0])
+
+
+# Counter-based random numbers for the compiled kernels (splitmix64).
+# Every stream is fully determined by (seed, sweep, stream id), so the
+# result of a sweep does not depend on how rows are spread over threads.
+@njit
+def rng_stream(seed, sweep, stream):
+    """
+    Initial state of stream `stream` in sweep `sweep` of the kernel seed `seed` (see stream_seed).
+    """
+    state = seed ^ (sweep * np.uint64(0xD1B54A32D192ED03)) \
+                 ^ (stream * np.uint64(0x8CB92BA72F3D8DD7))
+    state, _ = rng_next(state)
+    return state
+
+
+@njit
+def rng_next(state):
+    """
+    Advances a stream, returns (new state, uniform number in [0, 1) with 53 random bits).
+    """
+    state = state + np.uint64(0x9E3779B97F4A7C15)
+    z = state
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z = z ^ (z >> np.uint64(31))
+    return state, (z >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+
+def generator_state(rng):
+    """
+    State of a Generator as plain JSON serialisable values (arrays become tagged lists).
+    """
+    def plain(value):
+        if isinstance(value, dict):
+            return {key: plain(item) for key, item in value.items()}
+        if isinstance(value, np.ndarray):
+            return {'ndarray': value.tolist(), 'dtype': str(value.dtype)}
+        return value
+    return plain(rng.bit_generator.state)
+
+
+def set_generator_state(rng, state):
+    """
+    Restores a state returned by generator_state().
+    """
+    def restore(value):
+        if isinstance(value, dict):
+            if 'ndarray' in value:
+                return np.array(value['ndarray'], dtype=value['dtype'])
+            return {key: restore(item) for key, item in value.items()}
+        return value
+    rng.bit_generator.state = restore(state)
+
+
+class sweep_randoms:
+    """
+    Random numbers of a whole random-site Metropolis sweep, drawn in bulk.
+
+    One call of draw() replaces 3 * N * N separate calls into the generator:
+    site coordinates and one uniform number per update attempt, the buffer of
+    uniform numbers is allocated once and reused for every sweep.
+
+    Attributes:
+        rng (np.random.Generator): Source of the numbers.
+        arr_size (int): Size of the square lattice.
+        attempts (int): Number of update attempts per sweep, N * N by default.
+    """
+    def __init__(self, rng, arr_size, attempts=None):
+        self.rng = rng
+        self.arr_size = arr_size
+        if attempts == None:
+            attempts = arr_size * arr_size
+        self.attempts = attempts
+        self.uniforms = np.empty(attempts)
+
+
+    def draw(self):
+        """
+        Returns:
+            tuple: Arrays idx_x, idx_y of the updated sites and the uniform numbers
+                compared with their acceptance probabilities.
+        """
+        idx_x = self.rng.integers(0, self.arr_size, size=self.attempts)
+        idx_y = self.rng.integers(0, self.arr_size, size=self.attempts)
+        self.rng.random(out=self.uniforms)
+        return idx_x, idx_y, self.uniforms
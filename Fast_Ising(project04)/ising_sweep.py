@@ -0,0 +1,146 @@
+import itertools
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ising_numba import ising_simulation_numba
+from decorator01 import registry
+
+
+RESULT_COLUMNS = [('task', np.int64),
+                  ('beta', np.float64),
+                  ('force_B', np.float64),
+                  ('ups_density', np.float64),
+                  ('seed', np.uint64),
+                  ('stream_id', np.int64),
+                  ('M', np.float64),
+                  ('abs_M', np.float64),
+                  ('E', np.float64),
+                  ('run_time', np.float64)]
+
+
+def parameter_grid(beta, force_B=(0.0,), ups_density=(0.5,)):
+    """
+    Cartesian product of the scanned parameters, as a list of dicts.
+    """
+    return [{'beta': b, 'force_B': f, 'ups_density': u}
+            for b, f, u in itertools.product(beta, force_B, ups_density)]
+
+
+def _warm_up(engine):
+    # compile the numba kernels once per worker, so run_time does not include it
+    sim = ising_simulation_numba(arr_size=4, j=1, beta=1, force_B=0, amount_of_steps=1, seed=0)
+    sim.big_step(engine)
+
+
+def _run_point(task, point, seed, arr_size, j, amount_of_steps, equilibration_steps, engine, profile):
+    if profile == True:
+        registry.reset()  # only the timings of this task go back to the parent
+        registry.start_spans()
+    sim = ising_simulation_numba(arr_size=arr_size,
+                                 j=j,
+                                 beta=point['beta'],
+                                 force_B=point['force_B'],
+                                 amount_of_steps=amount_of_steps,
+                                 ups_density=point['ups_density'],
+                                 engine=engine,
+                                 seed=seed,
+                                 stream_id=task)
+
+    measured = amount_of_steps - equilibration_steps
+    M = np.empty(measured)
+    E = np.empty(measured)
+    start = time.perf_counter()
+    for step in range(amount_of_steps):
+        sim.big_step()
+        if step >= equilibration_steps:
+            M[step - equilibration_steps] = sim.calculate_M()
+            E[step - equilibration_steps] = sim.hamiltionian / sim.M.size
+    run_time = time.perf_counter() - start
+
+    row = (task, point['beta'], point['force_B'], point['ups_density'], seed, task,
+           M.mean(), np.abs(M).mean(), E.mean(), run_time)
+    return row, registry.snapshot() if profile == True else None
+
+
+def run_sweep(grid,
+              arr_size,
+              amount_of_steps,
+              j = 1,
+              equilibration_steps = 0,
+              engine = 'checkerboard',
+              seed = 0,
+              max_workers = None,
+              table_filename = None,
+              profile_filename = None):
+    """
+    Runs one ising_simulation_numba per point of the parameter grid on a process pool.
+
+    Task number k runs stream k of `seed` (see ising_rng), so the results only
+    depend on `seed` and the position of the point in the grid, not on the
+    number of workers or the order in which tasks finish.
+
+    Args:
+        grid (list of dict): Points with 'beta', 'force_B' and 'ups_density' keys,
+            e.g. from parameter_grid().
+        arr_size (int): Size of the square lattice.
+        amount_of_steps (int): Number of sweeps per point.
+        j (float): Interaction strength between neighboring spins.
+        equilibration_steps (int): Sweeps discarded before averaging observables.
+        engine (str): Engine passed to ising_simulation_numba.
+        seed (int): Root seed of the whole sweep.
+        max_workers (int): Number of worker processes, all cores by default.
+        table_filename (str): If given, every finished task is appended to this
+            tab separated file as soon as it completes.
+        profile_filename (str): If given, the TimerDecorator statistics of all
+            workers are merged and written there with registry.export_json.
+
+    Returns:
+        np.ndarray: Structured array with RESULT_COLUMNS, one row per grid point
+            ordered as the grid. M, abs_M and E (per spin) are averaged over the
+            measured sweeps, run_time is the wall time of the sweeps in seconds.
+    """
+    if equilibration_steps >= amount_of_steps:
+        raise ValueError("equilibration_steps must be smaller than amount_of_steps.")
+
+    results = np.zeros(len(grid), dtype=RESULT_COLUMNS)
+
+    table = None
+    if table_filename != None:
+        table = open(table_filename, 'w')
+        table.write('\t'.join(name for name, _ in RESULT_COLUMNS) + '\n')
+
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=_warm_up,
+                                 initargs=(engine,)) as executor:
+            futures = [executor.submit(_run_point, task, point, seed, arr_size, j,
+                                       amount_of_steps, equilibration_steps, engine,
+                                       profile_filename != None)
+                       for task, point in enumerate(grid)]
+
+            for future in as_completed(futures):
+                row, snapshot = future.result()
+                results[row[0]] = row
+                if snapshot != None:
+                    registry.merge(snapshot)
+                if table != None:
+                    table.write('\t'.join(str(value) for value in row) + '\n')
+                    table.flush()
+    finally:
+        if table != None:
+            table.close()
+
+    if profile_filename != None:
+        registry.export_json(profile_filename)
+    return results
+
+
+if __name__ == "__main__":
+    grid = parameter_grid(beta=np.linspace(0.2, 0.6, 9), force_B=[0.0, 0.1])
+    results = run_sweep(grid,
+                        arr_size=64,
+                        amount_of_steps=200,
+                        equilibration_steps=100,
+                        table_filename='sweep_results.txt')
+    for row in results:
+        print(f"beta={row['beta']:.3f} B={row['force_B']:.2f} <|M|>={row['abs_M']:.4f} <E>={row['E']:.4f}")
@@ -0,0 +1,203 @@
+import numpy as np
+from numba import njit, prange
+from decorator01 import TimerDecorator, print_stats
+from boltzmann import boltzmann_table
+from ising_rng import new_seed, make_generator, stream_seed, rng_stream, rng_next
+
+
+@njit
+def _replica_sweep(M, table, j, force_B, seed, sweep, stream_offset):
+    # serial red/black sweep of one replica, same update rule as checkerboard_sweep
+    N = M.shape[0]
+    delta_E = 0.0
+    delta_M = 0
+
+    for color in range(2):
+        for idx_x in range(N):
+            state = rng_stream(seed, sweep, np.uint64(stream_offset + 2 * idx_x + color))
+            x_up = (idx_x - 1) % N
+            x_down = (idx_x + 1) % N
+
+            for idx_y in range((idx_x + color) % 2, N, 2):
+                s_i = M[idx_x, idx_y]
+                neighbours = M[x_up, idx_y] + M[x_down, idx_y] \
+                           + M[idx_x, (idx_y - 1) % N] + M[idx_x, (idx_y + 1) % N]
+
+                prob = table[5 * (s_i > 0) + (neighbours + 4) // 2]
+                if prob < 1.0:
+                    state, r = rng_next(state)
+                    if r >= prob:
+                        continue
+                M[idx_x, idx_y] = -s_i
+                delta_E += 2 * s_i * (j * neighbours + force_B)
+                delta_M -= 2 * s_i
+
+    return delta_E, delta_M
+
+
+@njit(parallel=True)
+def tempering_sweeps(M, tables, j, force_B, seed, sweep, amount):
+    """
+    Runs `amount` sweeps of every replica, replicas are spread over threads.
+
+    M has shape (K, N, N) and tables[k] is the acceptance table of replica k.
+    Returns the change of energy and of the spin sum of every replica.
+    """
+    K, N = M.shape[0], M.shape[1]
+    delta_E = np.zeros(K)
+    delta_M = np.zeros(K, dtype=np.int64)
+
+    for k in prange(K):
+        for step in range(amount):
+            dE, dM = _replica_sweep(M[k], tables[k], j, force_B, seed,
+                                    sweep + np.uint64(step), np.uint64(k * 2 * N))
+            delta_E[k] += dE
+            delta_M[k] += dM
+
+    return delta_E, delta_M
+
+
+class parallel_tempering:
+    """
+    Class for replica exchange (parallel tempering) simulations of the 2D Ising model.
+
+    K lattices are simulated at a ladder of inverse temperatures, one replica per
+    thread. Every swap_interval sweeps, neighbouring temperatures try to exchange
+    their configurations with probability min(1, exp((beta_k - beta_k+1) * (E_k - E_k+1))).
+    Configurations are never copied, only the assignment of lattices to temperatures.
+
+    Attributes:
+        arr_size (int): Size of every square lattice (arr_size x arr_size), must be even.
+        j (float): Interaction strength between neighboring spins.
+        betas (np.ndarray): Ladder of inverse temperatures, sorted ascending.
+        force_B (float): External magnetic field strength.
+        bigsteps (int): Number of sweeps performed by simulate().
+        swap_interval (int): Number of sweeps between replica exchange attempts.
+        seed (int): Seed of the random streams.
+        stream_id (int): Stream of the seed used by this simulation, give parallel runs different ids.
+        M (np.ndarray): Lattices of all replicas, shape (K, arr_size, arr_size).
+        lattice_of_beta (np.ndarray): Index of the lattice currently at betas[k].
+        hamiltionian (np.ndarray): Running energy of every lattice.
+        total_spin (np.ndarray): Running sum of spins of every lattice.
+        swap_attempts (np.ndarray): Exchange attempts between betas[k] and betas[k+1].
+        swap_accepts (np.ndarray): Accepted exchanges between betas[k] and betas[k+1].
+        magnetisation_series (list): Magnetisation at every beta after each exchange round.
+        energy_series (list): Energy at every beta after each exchange round.
+
+    Methods:
+        big_step(amount): Sweeps every replica `amount` times in parallel.
+        swap_step(): Attempts exchanges between neighbouring temperatures.
+        simulate(): Runs bigsteps sweeps with exchanges every swap_interval sweeps.
+        calculate_M(): Returns the magnetisation at every beta.
+        calculate_E(): Returns the energy at every beta.
+        swap_acceptance_rates(): Returns the acceptance rate of every neighbouring pair.
+    """
+    def __init__(self,
+                 arr_size,
+                 j,
+                 betas,
+                 force_B,
+                 amount_of_steps,
+                 swap_interval = 10,
+                 ups_density = 0.5,
+                 seed = None,
+                 stream_id = 0):
+        if arr_size % 2 != 0:
+            raise ValueError("Parallel tempering requires an even arr_size.")
+        self.j = j
+        self.betas = np.sort(np.asarray(betas, dtype=np.float64))
+        self.force_B = force_B
+        self.bigsteps = amount_of_steps
+        self.swap_interval = swap_interval
+        if seed == None:
+            seed = new_seed()
+        self.seed = int(seed)
+        self.stream_id = stream_id
+        self.sweep = 0
+        self.rng = make_generator(self.seed, self.stream_id)
+        self.kernel_seed = stream_seed(self.seed, self.stream_id)
+
+        K = self.betas.size
+        self.M = (-1)*np.ones([K, arr_size, arr_size], dtype=np.int8)
+        amount_of_ups = int(ups_density * arr_size * arr_size)
+        for k in range(K):
+            idxes = self.rng.choice(arr_size * arr_size, amount_of_ups, replace=False)
+            self.M[k].flat[idxes] = 1
+
+        self.lattice_of_beta = np.arange(K)
+        self.swap_attempts = np.zeros(K - 1, dtype=np.int64)
+        self.swap_accepts = np.zeros(K - 1, dtype=np.int64)
+        self.magnetisation_series = []
+        self.energy_series = []
+        self.recalculate_observables()
+
+
+    def recalculate_observables(self):
+        bonds = (self.M * (np.roll(self.M, 1, axis=1) + np.roll(self.M, 1, axis=2))).sum(axis=(1, 2))
+        self.total_spin = self.M.sum(axis=(1, 2)).astype(np.int64)
+        self.hamiltionian = ((-1) * self.j * bonds - self.force_B * self.total_spin).astype(np.float64)
+
+
+    def _tables(self):
+        # acceptance table of every lattice at the beta it currently sits at
+        tables = np.empty((self.betas.size, 10))
+        for k, lattice in enumerate(self.lattice_of_beta):
+            tables[lattice] = boltzmann_table(self.j, self.betas[k], self.force_B)
+        return tables
+
+
+    def big_step(self, amount=1):
+        delta_E, delta_M = tempering_sweeps(self.M, self._tables(), float(self.j), float(self.force_B),
+                                            self.kernel_seed, np.uint64(self.sweep), amount)
+        self.hamiltionian += delta_E
+        self.total_spin += delta_M
+        self.sweep += amount
+
+
+    def swap_step(self):
+        # alternate between even and odd pairs, so every pair is tried every second round
+        first = (self.sweep // self.swap_interval) % 2
+        for k in range(first, self.betas.size - 1, 2):
+            a, b = self.lattice_of_beta[k], self.lattice_of_beta[k + 1]
+            log_prob = (self.betas[k] - self.betas[k + 1]) * (self.hamiltionian[a] - self.hamiltionian[b])
+            self.swap_attempts[k] += 1
+            if log_prob >= 0 or self.rng.random() < np.exp(log_prob):
+                self.lattice_of_beta[k], self.lattice_of_beta[k + 1] = b, a
+                self.swap_accepts[k] += 1
+
+
+    @TimerDecorator
+    def simulate(self):
+        done = 0
+        while done < self.bigsteps:
+            amount = min(self.swap_interval, self.bigsteps - done)
+            self.big_step(amount)
+            done += amount
+            self.swap_step()
+            self.magnetisation_series.append(self.calculate_M())
+            self.energy_series.append(self.calculate_E())
+
+
+    def calculate_M(self):
+        return self.total_spin[self.lattice_of_beta] / self.M[0].size
+
+
+    def calculate_E(self):
+        return self.hamiltionian[self.lattice_of_beta].copy()
+
+
+    def swap_acceptance_rates(self):
+        return self.swap_accepts / np.maximum(self.swap_attempts, 1)
+
+
+if __name__ == "__main__":
+    pt = parallel_tempering(arr_size=64,
+                            j=1,
+                            betas=np.linspace(0.35, 0.55, 8),
+                            force_B=0,
+                            amount_of_steps=1000,
+                            swap_interval=5)
+    pt.simulate()
+    print_stats(pt.simulate)
+    for beta, rate, M in zip(pt.betas, pt.swap_acceptance_rates(), pt.calculate_M()):
+        print(f"beta={beta:.4f} swap rate to next={rate:.3f} M={M:.4f}")
@@ -7,6 +7,8 @@ class ising_simulation:
     """
     Class for simulating 2D Ising model using Metropolis algorithm.
 
+    Both sweep modes and calculate_hamiltionian() use periodic boundary conditions.
+
     Attributes:
         arr_size (int): Size of the square lattice (arr_size x arr_size).
         j (float): Interaction strength between neighboring spins.
@@ -17,11 +19,17 @@ class ising_simulation:
         img_filename (str): Filename to save the final spin configuration image.
         animation_filename (str): Filename to save the animation of the simulation.
         magnetisation_filename (str): Filename to save the magnetization data.
+        sweep_mode (str): 'random' for single-spin updates with small_step, or 'checkerboard'
+            for vectorized NumPy updates of whole sublattices (even arr_size).
+        seed (int): Seed of the random generator, drawn from OS entropy if not given.
+        stream_id (int): Independent random stream of the seed, e.g. one per process.
+        rng (np.random.Generator): Random generator used by the simulation.
 
     Methods:
         show_array(): Displays the current spin configuration as an image.
         calculate_hamiltionian(): Calculates and prints the Hamiltonian of the current configuration.
         small_step(): Performs a single Metropolis update on a randomly chosen spin.
+        checkerboard_step(color): Performs Metropolis updates of every spin on one checkerboard sublattice at once.
         big_step(): Performs a full sweep of Metropolis updates over the entire lattice.
         simulate(): Runs the simulation for the specified number of big steps.
         calculate_M(): Calculates and returns the magnetization of the current configuration.
@@ -35,7 +43,10 @@ class ising_simulation:
                  ups_density = 0.5, 
                  img_filename = None,
                  animation_filename = None,
-                 magnetisation_filename = None):
+                 magnetisation_filename = None,
+                 sweep_mode = 'random',
+                 seed = None,
+                 stream_id = 0):
         self.j = j
         self.beta = beta
         self.force_B = force_B
@@ -51,11 +62,26 @@ class ising_simulation:
                                                 [1, 0, 1],
                                                 [0, 1, 0]])
 
+        if seed == None:
+            seed = int(np.random.SeedSequence().entropy)
+        self.seed = seed
+        self.stream_id = stream_id
+        self.rng = np.random.Generator(np.random.PCG64(np.random.SeedSequence(seed, spawn_key=(stream_id,))))
+
         self.M = (-1)*np.ones([arr_size, arr_size], dtype=np.int8)
         amount_of_ups = int(self.ups_density * self.M.size)
-        idxes = np.random.choice(self.M.size, amount_of_ups, replace=False)
+        idxes = self.rng.choice(self.M.size, amount_of_ups, replace=False)
         self.M.flat[idxes] = 1
 
+        self.sweep_mode = sweep_mode
+        if self.sweep_mode == 'checkerboard':
+            if arr_size % 2 != 0:
+                raise ValueError("Checkerboard sweep requires an even arr_size.")
+            parity = np.add.outer(np.arange(arr_size), np.arange(arr_size)) % 2
+            self.checkerboard_masks = (parity == 0, parity == 1)
+        elif self.sweep_mode != 'random':
+            raise ValueError(f"Unknown sweep mode: {sweep_mode}")
+
 
     def draw_array(self, number, show=False):
         image_size = 1000
@@ -89,21 +115,21 @@ class ising_simulation:
 
     def calculate_hamiltionian(self):
         self.hamiltionian = (-1) * 1/2 * self.j * (  \
-                self.M * signal.convolve2d(self.M, self.neighborhood_kernel, mode = 'same') \
+                self.M * signal.convolve2d(self.M, self.neighborhood_kernel, mode = 'same', boundary = 'wrap') \
                     ).sum() \
             - self.force_B * self.M.sum()
         print(self.hamiltionian)
         
 
     def small_step(self):
-        idx_x, idx_y = np.random.randint(0, self.M.shape[0], size=2)
+        idx_x, idx_y = self.rng.integers(0, self.M.shape[0], size=2)
         s_i = self.M[idx_x, idx_y]
         kh, kw = self.neighborhood_kernel.shape
         assert kh % 2 == 1 and kw % 2 == 1, "Kernel must have odd shape."
         ph, pw = kh // 2, kw // 2
 
-        # pad and extract the patch centered at (idx_x, j)
-        Mp = np.pad(self.M, ((ph, ph), (pw, pw)), mode='constant')
+        # pad periodically and extract the patch centered at (idx_x, j)
+        Mp = np.pad(self.M, ((ph, ph), (pw, pw)), mode='wrap')
         patch = Mp[idx_x:idx_x+kh, idx_y:idx_y+kw]  # because Mp is shifted by padding
         
         E_0 = (-1) * 1/2 * self.j * (  \
@@ -121,13 +147,31 @@ class ising_simulation:
             self.M[idx_x, idx_y] *= (-1)
         else:
             prob = np.exp( (-1) * self.beta * delta_E )
-            if np.random.rand() < prob:
+            if self.rng.random() < prob:
                 self.M[idx_x, idx_y] *= (-1)
 
 
+    def checkerboard_step(self, color):
+        # neighbour sums of the whole lattice with periodic boundary conditions,
+        # in int64 so that self.j * neighbours cannot wrap around like int8 would
+        neighbours = (np.roll(self.M, 1, axis=0) + np.roll(self.M, -1, axis=0)
+                      + np.roll(self.M, 1, axis=1) + np.roll(self.M, -1, axis=1)).astype(np.int64)
+
+        mask = self.checkerboard_masks[color]
+        s_i = self.M[mask]
+        delta_E = 2 * s_i * (self.j * neighbours[mask] + self.force_B)
+        prob = np.exp( (-1) * self.beta * np.maximum(delta_E, 0) )
+        flip = self.rng.random(s_i.size) < prob
+        self.M[mask] = np.where(flip, -s_i, s_i)
+
+
     def big_step(self):
-        for _ in range(self.M.size):
-            self.small_step()
+        if self.sweep_mode == 'checkerboard':
+            self.checkerboard_step(0)
+            self.checkerboard_step(1)
+        else:
+            for _ in range(self.M.size):
+                self.small_step()
 
 
     # Visualisation and output methods